@@ -170,7 +170,8 @@ class PhysicalCrane(Crane):
         """Sets the waypoints to be executed by the crane.
 
         Args:
-            waypoints (list[Waypoint]): List of Waypoints.
+            waypoints (np.ndarray): 4 x N array with rows t, x, v and a
+                (or a tuple of four equally long arrays), t in s, x in mm, v in mm/s and a in mm/s^2.
         """
         self.waypoints = waypoints
 
@@ -182,8 +183,6 @@ class PhysicalCrane(Crane):
         Returns:
             tuple(list[float], list[float], list[float], list[float], list[float], list[float]): tuple(t, x, v, a, theta, omega), 
         """
-        self.cartStepper.setPositionMode()
-
         # logging:
         # we can log the following: t, x, v, theta
         # omega is not logged but is calculated afterwards
@@ -191,43 +190,54 @@ class PhysicalCrane(Crane):
 
         # assume t = 0
         t = [0]
-        x = [self.cartStepper.getPositionMm()]
         v = [0]
         theta = [0]
         omega_arduino = [0]
         wspeed = [0]
         a = [0]
         wp_dt = []
-        # reset angle logger input buffer
-        if self.crane_io_uc is not None:
-            self.crane_io_uc.reset_input_buffer()
 
-        # set target position
-        self.cartStepper.setAccelLimit(2147483647)
-        self.cartStepper.setVelocityLimit(abs(self.waypoints[1].v*self.cartStepper.mm_s_to_rpm))
-        t0 = time.time()
-        now = 0
-        self.cartStepper.setPositionMm(self.waypoints[-1].x)
+        # waypoints are stored as one array per quantity
+        wp_ts, wp_xs, wp_vs, _ = self.waypoints
 
-        for wp in self.waypoints[1:]:
+        # the state logger reads the same ports from its own thread (see getState), every
+        # exchange with the motors and the angle sensor holds its lock so the requests and
+        # responses of the two threads don't interleave on the bus
+        with self.get_state_lock:
+            self.cartStepper.setPositionMode()
+            x = [self.cartStepper.getPositionMm()]
+            # reset angle logger input buffer
+            if self.crane_io_uc is not None:
+                self.crane_io_uc.reset_input_buffer()
+
+            # set target position
+            self.cartStepper.setAccelLimit(2147483647)
+            self.cartStepper.setVelocityLimit(abs(wp_vs[1]*self.cartStepper.mm_s_to_rpm))
+            t0 = time.time()
+            now = 0
+            self.cartStepper.setPositionMm(wp_xs[-1])
+
+        # plain python floats are faster to compare in the timing loop than numpy scalars
+        for wp_t, wp_v in zip(wp_ts[1:].tolist(), wp_vs[1:].tolist()):
             
             wp_start = time.time()
             # in proper version I must not forget to consider direction of the movement as well.
-            while(now < wp.t):
+            while(now < wp_t):
                 now = time.time() - t0
 
-            self.cartStepper.setVelocityLimit(abs(wp.v)*self.cartStepper.mm_s_to_rpm)
-            
-            # logging
-            
-            t.append(time.time() - t0)
-            tick = time.time()
-            #x.append(self.mc.read_register(self.mc.REG.PID_POSITION_ACTUAL, signed=True))
-            x.append(self.cartStepper.getPositionMm()) 
-            #v.append(self.mc.read_register(self.mc.REG.PID_VELOCITY_ACTUAL, signed=True))
-            v.append(self.cartStepper.getVelocity())
-            dt = time.time() - tick
-            new_theta, new_omega, new_wspeed = self.crane_io_uc.getState()
+            with self.get_state_lock:
+                self.cartStepper.setVelocityLimit(abs(wp_v)*self.cartStepper.mm_s_to_rpm)
+
+                # logging
+
+                t.append(time.time() - t0)
+                tick = time.time()
+                #x.append(self.mc.read_register(self.mc.REG.PID_POSITION_ACTUAL, signed=True))
+                x.append(self.cartStepper.getPositionMm())
+                #v.append(self.mc.read_register(self.mc.REG.PID_VELOCITY_ACTUAL, signed=True))
+                v.append(self.cartStepper.getVelocity())
+                dt = time.time() - tick
+                new_theta, new_omega, new_wspeed = self.crane_io_uc.getState()
             new_a = 0 # not measured for now.
             theta.append(new_theta)
             a.append(new_a)
@@ -239,9 +249,10 @@ class PhysicalCrane(Crane):
             wp_dt.append(wp_end-wp_start)
 
 
-        self.cartStepper.setTorqueMode()
-        # self.hoistStepper.setTorqueMode()
-        self.cartStepper.setTorque(0)
+        with self.get_state_lock:
+            self.cartStepper.setTorqueMode()
+            # self.hoistStepper.setTorqueMode()
+            self.cartStepper.setTorque(0)
         # self.hoistStepper.setTorque(0)
 
         # For logging:
@@ -376,6 +387,8 @@ class Waypoint():
     """A class representing a Waypoint, that is, one point in a trajectory
     """
 
+    __slots__ = ('t', 'x', 'v', 'a', 'l', 'dr', 'ddr')
+
     def __init__(self, t, x, v, a, l = 150, dr = 0, ddr = 0) -> None:
         self.x = x
         self.v = v
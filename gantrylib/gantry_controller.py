@@ -1,20 +1,93 @@
 from abc import abstractmethod
+from collections import OrderedDict
+import concurrent.futures as cf
 from typing_extensions import override
 from gantrylib.gantry_database_io_factory import GantryDatabaseFactory
 from gantrylib.trajectory_generator import TrajectoryGenerator
-from datetime import timedelta, datetime
-from time import sleep
+from datetime import datetime
+from time import sleep, monotonic
 import logging
-from gantrylib.crane import PhysicalCrane, Waypoint
+import hashlib
+import os
+import pathlib
+import struct
+from gantrylib.crane import PhysicalCrane
 import numpy as np
-from scipy.signal import correlate
 from gantrylib.gantry_database_io_factory import DatabaseType
+from gantrylib.gantry_database_io import TRAJECTORY_QUANTITIES, _to_timestamps
 from gantrylib.gantry_state_logger import CraneStateLogger, NullStateLogger
+from gantrylib.interpolation import _interp_rows
 
 from gantrylib.gantry_simulator import GantrySimulator, NullGantrySimulator
 
 from gantrylib.gantry_validator import Validator, NullValidator
 
+# directory in which generated trajectories are cached between runs, one .npy file per trajectory.
+# only the TRAJECTORY_CACHE_SIZE most recently used files are kept, older ones are removed.
+TRAJECTORY_CACHE_DIR = pathlib.Path("~/.cache/gantry_traj").expanduser()
+TRAJECTORY_CACHE_SIZE = 1024
+# number of trajectories also kept in memory, most recently used last
+TRAJECTORY_MEMO_SIZE = 256
+_trajectory_memo = OrderedDict()
+# largest shift (in samples) searched for between a trajectory and its measurement
+MAX_TIME_SHIFT_LAG = 25
+
+def _wait_until_reached(stepper, tgt, tolerance=100, timeout=None):
+    """Poll a stepper until it is within tolerance of its target position
+
+    The poll interval starts at 1 ms and doubles up to 100 ms, so short
+    moves are detected promptly without hammering the motor bus on long ones.
+
+    Args:
+        stepper (Stepper): The stepper to poll.
+        tgt (int): The target position in counts.
+        tolerance (int, optional): Allowed deviation in counts. Defaults to 100.
+        timeout (float, optional): Maximum time to wait in seconds. Defaults to None (wait forever).
+
+    Raises:
+        TimeoutError: If the target is not reached within timeout.
+
+    Returns:
+        int: The last position read from the stepper.
+    """
+    deadline = None if timeout is None else monotonic() + timeout
+    delay = 0.001
+    position = stepper.getPosition()
+    while abs(position - tgt) > tolerance:
+        if deadline is not None and monotonic() > deadline:
+            raise TimeoutError(f"stepper did not reach {tgt}, last position {position}")
+        sleep(delay)
+        delay = min(0.1, delay * 2)
+        position = stepper.getPosition()
+    return position
+
+def _argmax_xcorr_bounded(a, b, max_lag):
+    """Find the lag that maximizes the cross-correlation of two equally long traces
+
+    Only lags in [-max_lag, max_lag] are evaluated, which is O(N * max_lag)
+    instead of correlating the full traces. Lags follow the convention of
+    scipy.signal.correlate(a, b, mode='full').
+
+    Args:
+        a (np.ndarray): First trace.
+        b (np.ndarray): Second trace.
+        max_lag (int): Largest lag (in samples) to evaluate.
+
+    Returns:
+        int: The lag with the highest correlation.
+    """
+    n = len(a)
+    max_lag = min(max_lag, n - 1)
+    best_lag, best = 0, -np.inf
+    for lag in range(-max_lag, max_lag + 1):
+        if lag >= 0:
+            s = np.dot(a[lag:], b[:n - lag])
+        else:
+            s = np.dot(a[:n + lag], b[-lag:])
+        if s > best:
+            best_lag, best = lag, s
+    return best_lag
+
 class GantryController():
     """A class representing a controller for the gantry crane
     """
@@ -26,15 +99,19 @@ class GantryController():
             config (dict): Configuration dictionary holding details of the gantry crane.
         """
         logging.info("Initializing GantryController")
+        # keep the parsed configuration around so subclasses don't need to reload it
+        self.config = config
         # machine identification in database
         self.id = config["machine_id"]
         self.name = config["machine_name"]
         # connection to database
+        self._connected = False
         if config["connect_to_db"]:
             # create a database connection
             logging.info("Connecting to database")
             self.dbconn = GantryDatabaseFactory.create_database(DatabaseType.POSTGRES, config)
             self.dbconn.connect()
+            self._connected = True
             # Give own dbconn to the logger.
             if config["db_continuous_log"]:
                 logging.info("Starting continuous logging")
@@ -42,7 +119,9 @@ class GantryController():
                     dbconn2 = GantryDatabaseFactory.create_database(DatabaseType.POSTGRES, config)
                     dbconn2.auto_commit = True
                     dbconn2.connect()
-                    self.continuous_logger = CraneStateLogger(None, dbconn2, config["db_continuous_log_rate"], machine_id=self.id)
+                    # measurements the database can't take yet wait in the spill file, a temporary file if not configured
+                    self.continuous_logger = CraneStateLogger(None, dbconn2, config["db_continuous_log_rate"], machine_id=self.id,
+                                                              spill_file=config.get("db_spill_file"))
                 else:
                     self.continuous_logger = NullStateLogger()
             else:
@@ -58,7 +137,8 @@ class GantryController():
 
         self.tg = TrajectoryGenerator(config)
 
-        self.run = self.dbconn.get_next_run_id(self.id)
+        # run number is only fetched from the database when it's needed before the first move
+        self._run = None
 
         self.repls = config["replications"]
 
@@ -70,6 +150,14 @@ class GantryController():
         self.position = 0
 
         self.simrepls = config["replications"]
+
+        # worker threads for database I/O that can overlap with trajectory execution
+        self._io = cf.ThreadPoolExecutor(max_workers=2)
+        # worker threads for splitting up numpy work that releases the GIL
+        self._compute = cf.ThreadPoolExecutor(max_workers=min(5, os.cpu_count() or 1))
+        # simulations of the last run, they keep running after moveOptimally returns
+        self._sim_fut = None
+        self._sim_run = None
         if config["connect_to_db"]:
             self.simulator = GantrySimulator(config)
             self.validator = Validator(config)
@@ -77,6 +165,21 @@ class GantryController():
             self.simulator = NullGantrySimulator()
             self.validator = NullValidator()
 
+    @property
+    def run(self):
+        """The current run number
+
+        Returns:
+            int: The current run number
+        """
+        if self._run is None:
+            self._run = self.dbconn.get_next_run_id(self.id)
+        return self._run
+
+    @run.setter
+    def run(self, run_id):
+        self._run = run_id
+
     def __enter__(self):
         """Enter the runtime context of the gantry controller.
 
@@ -93,10 +196,17 @@ class GantryController():
             exc_value (BaseException or None): The exception instance if one was raised, else None.
             traceback (TracebackType or None): The traceback object if an exception was raised, else None.
         """
+        # let pending database writes and simulations finish before disconnecting
         try:
+            self.wait_for_simulations()
+        except Exception as e:
+            logging.error("Simulations failed: %s", e)
+        self._io.shutdown(wait=True)
+        self._compute.shutdown(wait=True)
+        # disconnect logs its own errors
+        if self._connected:
             self.dbconn.disconnect()
-        except Exception:
-            pass
+            self._connected = False
     
     def cleanup(self):
         """Cleanup the continuous logging data
@@ -104,6 +214,9 @@ class GantryController():
         This method is called when the controller is exited.
         It will stop the continuous logger and flush the buffer.
         """
+        if type(self.continuous_logger) is NullStateLogger:
+            # nothing was logged, so there is nothing to stop or remove
+            return
         try:   
             logging.info("Stopping continuous logging")
             self.continuous_logger.stop_logging()
@@ -113,10 +226,13 @@ class GantryController():
             logging.error(f"Failed to cleanup continuous logging data: {e}")
 
     @abstractmethod
-    def connectToCrane(self):
+    def connectToCrane(self, config: dict = None):
         """Method to connect to the gantry crane.
 
         This method must be implemented by subclasses to define how to connect to a specific gantry crane.
+
+        Args:
+            config (dict, optional): The configuration dictionary. Defaults to the one given at initialization.
         """
         pass
     
@@ -129,18 +245,103 @@ class GantryController():
             genmethod (str, optional): Method of generation, either "ocp" or "lqr". Defaults to "ocp".
 
         Returns:
-            tuple: Tuple containing the trajectory
+            np.ndarray: 8 x N array (ts, xs, dxs, ddxs, thetas, dthetas, ddthetas, us) holding the trajectory,
+                or None if no trajectory could be generated.
         """
         # retrieve rope length and configure it in the trajectory generator
         if self.crane:
             hoistpos = self.crane.hoistStepper.getPositionMm()/1000
-            logging.info(f"Hoist position is {hoistpos} mm")
+            logging.info("Hoist position is %s mm", hoistpos)
             self.tg.r = self.crane.getRopeLength()/1000
-            logging.info(f"Rope length is {self.tg.r} m")
+            logging.info("Rope length is %s m", self.tg.r)
+
+        # solving the ocp is slow, so look for an earlier solution of the same problem first.
+        # the memory and disk caches share one key.
+        key = self._trajectory_key(start, stop, genmethod)
+        # the memo hands out copies, so callers can't modify the cached arrays
+        traj = _trajectory_memo.get(key)
+        if traj is not None:
+            logging.info("Using trajectory from memory cache")
+            _trajectory_memo.move_to_end(key)
+            return traj.copy()
+        path = TRAJECTORY_CACHE_DIR / f"{key}.npy"
+        if path.exists():
+            logging.info("Loading cached trajectory from %s", path)
+            try:
+                traj = np.load(path, allow_pickle=False)
+                # mark the file as recently used, so pruning the cache keeps it
+                os.utime(path)
+            except (OSError, ValueError) as e:
+                logging.warning("Ignoring unreadable cached trajectory %s: %s", path, e)
+            else:
+                self._memoize_trajectory(key, traj)
+                return traj.copy()
+
         if genmethod == 'ocp':
-            return self.tg.generateTrajectory(start, stop)
+            traj = self.tg.generateTrajectory(start, stop)
         else:
-            return self.tg.generateTrajectoryLQR(start, stop)
+            traj = self.tg.generateTrajectoryLQR(start, stop)
+
+        # only cache actual solutions, failed generations return None
+        if traj is not None:
+            # keep the trajectory as one contiguous 8 x N array, rows in the order of the generator's tuple
+            traj = np.array(traj, dtype=np.float64)
+            self._memoize_trajectory(key, traj.copy())
+            try:
+                path.parent.mkdir(parents=True, exist_ok=True)
+                np.save(path, traj, allow_pickle=False)
+                self._prune_trajectory_cache()
+            except OSError as e:
+                logging.warning("Failed to cache trajectory: %s", e)
+        return traj
+
+    def _trajectory_key(self, start, stop, genmethod):
+        """Compute the key under which a generated trajectory is cached
+
+        Args:
+            start (float): The start position of the trajectory
+            stop (float): The stop position of the trajectory
+            genmethod (str): Method of generation, either "ocp" or "lqr".
+
+        Returns:
+            str: Hex digest identifying the problem solved by the trajectory generator.
+        """
+        # arguments are rounded to 0.1 mm / 0.1 mm rope length, so near duplicates hit the cache too.
+        # the generator's limits are part of the key, a changed config must not reuse old solutions.
+        return hashlib.blake2b(struct.pack("ddd", round(start, 4), round(stop, 4), round(self.tg.r, 4))
+                               + genmethod.encode() + self._generator_fingerprint(), digest_size=16).hexdigest()
+
+    def _generator_fingerprint(self):
+        """Describe the trajectory generator's configuration, for use in trajectory cache keys
+
+        Returns:
+            bytes: The generator's class and its public numeric and string settings, except for the rope length.
+        """
+        # the rope length changes with the hoist and is rounded into the key separately
+        settings = sorted((k, v) for k, v in vars(self.tg).items()
+                          if k != "r" and not k.startswith("_") and isinstance(v, (int, float, str)))
+        return repr((type(self.tg).__qualname__, settings)).encode()
+
+    @staticmethod
+    def _prune_trajectory_cache():
+        """Remove the least recently used trajectories once the cache directory holds more than TRAJECTORY_CACHE_SIZE
+        """
+        files = sorted(TRAJECTORY_CACHE_DIR.glob("*.npy"), key=lambda f: f.stat().st_mtime)
+        for f in files[:max(len(files) - TRAJECTORY_CACHE_SIZE, 0)]:
+            f.unlink(missing_ok=True)
+
+    @staticmethod
+    def _memoize_trajectory(key, traj):
+        """Keep a trajectory in the in-memory cache, evicting the least recently used one
+
+        Args:
+            key (str): The cache key of the trajectory.
+            traj (np.ndarray): The trajectory, owned by the cache from now on.
+        """
+        _trajectory_memo[key] = traj
+        _trajectory_memo.move_to_end(key)
+        if len(_trajectory_memo) > TRAJECTORY_MEMO_SIZE:
+            _trajectory_memo.popitem(last=False)
 
     def moveOptimally(self, target, generator = 'ocp', write_to_db = False, simulate = False, validate = False):
         """Make a movement and log it to a database
@@ -161,73 +362,119 @@ class GantryController():
         if simulate and not write_to_db:
             logging.info("Simulation requires writing to the database, otherwise all results just get lost.")
         
-        logging.info("Generating trajectory to " + str(target))
+        logging.info("Generating trajectory to %s", target)
         traj = self.generateTrajectory(self.crane.cartStepper.getPositionMm()/1000, target, generator)
         sleep(1.5) # sleep needed for initialization of the Arduino
         # TODO: check if the sleep is still needed? I don't think it is.
         logging.info("Trajectory generated")
 
-        # before executing the trajectory, pause the continuous logger
-        self.continuous_logger.pause()
-        # stopping the threads might be slightly more performant?
-        # self.continuous_logger.stop_logging()
-        # self.continuous_logger.flush_buffer()
+        # the continuous logger keeps running during the move, it batches its
+        # writes on its own connection so it doesn't hold up the control loop.
+        # the crane takes the same lock as getState for its bus traffic while executing.
 
-        logging.info("Executing trajectory")
         t_start = datetime.now()
-        measurement = self.executeTrajectory(traj)
-        logging.info("Trajectory executed, updating position")
-        self.position = self.crane.cartStepper.getPositionMm()
-        # align measurement to trajectory for storing
-        measurement = self._align_measurement_to_trajectory(traj, measurement)
+        # update traj to have absolute timestamps (datetime64[us]) for db,
+        # the other traces are shared with traj
+        traj_db = (_to_timestamps(t_start, traj[0]), *traj[1:])
 
-        # update traj en measurement to have timestamps in datetime format for db
-        # convert to lists, so we can modify them
-        traj = list(traj)
-        measurement = list(measurement)
-        traj[0] = [t_start + timedelta(seconds=t) for t in traj[0]]
-        measurement[0] = [t_start + timedelta(seconds=t) for t in measurement[0]]
-        logging.info("Trajectory and measurement timestamps updated")
-
-        # writeout current run to database.
         if write_to_db:
-            self.run =self.dbconn.get_next_run_id(self.id)
-            logging.info("Run number updated to " + str(self.run))
-            # fetch run number from database
+            # the run and trajectory don't depend on the measurement, so write them
+            # out in the background while the (long) trajectory execution is going on.
             logging.info("Storing in database")
-            # create a new run in the database
-            self.dbconn.store_run(self.run, self.id, t_start)
-            self.dbconn.store_trajectory(self.id, self.run, traj)
-            # store measurements
-            logging.info("Storing measurement in database")
-            self.dbconn.store_measurement(self.id, self.run, measurement)
-            logging.info("Measurement stored in database")
+            store_fut = self._io.submit(self._store_run_and_trajectory, t_start, traj_db)
+
+        try:
+            logging.info("Executing trajectory")
+            measurement = self.executeTrajectory(traj)
+            logging.info("Trajectory executed, updating position")
+            self.position = self.crane.cartStepper.getPositionMm()
+            # align measurement to trajectory for storing
+            measurement = self._align_measurement_to_trajectory(traj, measurement)
+
+            # update measurement to have timestamps in datetime format for db
+            traj = traj_db
+            measurement = (_to_timestamps(t_start, measurement[0]), *measurement[1:])
+            logging.info("Trajectory and measurement timestamps updated")
+
+            # writeout current run to database.
+            if write_to_db:
+                # run, trajectory and measurement form a single transaction, committed once
+                # (or rolled back if storing any of them fails). commit before simulating and
+                # validating, since they read the data over their own connections.
+                with self.dbconn.transaction():
+                    # the run must exist before measurements can refer to it,
+                    # this also reraises any exception from storing the trajectory.
+                    store_fut.result()
+                    logging.info("Run number updated to %s", self.run)
+                    # store measurements
+                    logging.info("Storing measurement in database")
+                    self.dbconn.store_measurement(self.id, self.run, measurement)
+                    logging.info("Measurement stored in database")
+        except BaseException:
+            if write_to_db:
+                # the run and trajectory may still be uncommitted (or being written) on the
+                # connection, the next run's transaction must not commit them without a measurement
+                try:
+                    store_fut.result()
+                except Exception:
+                    pass
+                self.dbconn.rollback()
+            raise
 
-            # commit already, since simulator and validator will use the data.
-            self.dbconn.commit()
+        if write_to_db:
+            if simulate or validate:
+                # the simulator isn't reentrant, so the previous run's simulations must be done.
+                # if they failed that's an error of the previous run, this one still gets simulated.
+                try:
+                    self.wait_for_simulations()
+                except Exception as e:
+                    logging.error("Simulations of run %s failed: %s", self._sim_run, e)
 
             # perform simulations.
             if simulate:
                 logging.info("Simulating trajectory")
-                # simulate the trajectory
-                self.simulator.run_simulations(self.run, self.simrepls, self.tg.r)
-                logging.info("Trajectories simulated and stored")
+                # simulate the trajectory in the background, the simulator uses its own
+                # connection, so this can keep running after returning to the caller.
+                self._sim_run = self.run
+                self._sim_fut = self._io.submit(self.simulator.run_simulations, self.run, self.simrepls, self.tg.r)
 
             # if 
             if validate:
+                # validation compares against the simulations of this run, their failure is raised
+                self.wait_for_simulations()
                 logging.info("Validating trajectory")
                 self.validator.run_validation(self.run)
                 logging.info("Trajectories validated and stored")
-        
-            # after everything has been stored without errors, commit
-            self.dbconn.commit()
-
-        # resume continuous logger
-        self.continuous_logger.resume()
-        # self.continuous_logger.start_logging()
 
         return traj, measurement   
 
+    def wait_for_simulations(self):
+        """Wait for the simulations started by the last moveOptimally to finish
+
+        moveOptimally only logs a failure of the previous run's simulations when it starts
+        new ones, call this to have it raised.
+
+        Raises:
+            Exception: Any exception raised while running the simulations.
+        """
+        if self._sim_fut is not None:
+            fut, self._sim_fut = self._sim_fut, None
+            fut.result()
+            logging.info("Trajectories simulated and stored")
+
+    def _store_run_and_trajectory(self, t_start, traj):
+        """Store a new run and its trajectory in the database
+
+        Args:
+            t_start (datetime): Start time of the run.
+            traj (tuple): Trajectory with datetime64 timestamps, followed by one array per quantity.
+        """
+        # create a new run in the database, the database hands out the run number
+        self.run = self.dbconn.create_run(self.id, t_start)
+        # the traces are arrays already, hand them over as columns
+        self.dbconn.store_trajectory_array(self.id, self.run, traj[0],
+                                           dict(zip(TRAJECTORY_QUANTITIES, traj[1:])))
+
     @abstractmethod
     def executeTrajectory(self, traj):
         """Execute a trajectory
@@ -259,7 +506,7 @@ class GantryController():
         measurement = self._align_measurement_to_trajectory(traj, measurement)
         return measurement
     
-    def _find_time_shift(self, time1, trace1, time2, trace2):
+    def _find_time_shift(self, time1, trace1, time2, trace2, max_lag=None):
         """Finds the time shift between two traces
 
         Is used to correct any potential timeshift between the trajectory and the measurement.
@@ -269,6 +516,7 @@ class GantryController():
             trace1 (list[float]): First datapoints.
             time2 (list[float]): Second time traces
             trace2 (list[float]): Second datapoints.
+            max_lag (int, optional): Largest shift in samples to look for. Defaults to None, which searches all shifts.
 
         Returns:
             float: the time shift
@@ -276,13 +524,20 @@ class GantryController():
         # Interpolate the second trace onto the time points of the first trace
         interpolated_trace2 = np.interp(time1, time2, trace2)
 
-        # Cross-correlate the two traces
-        cross_corr = correlate(trace1, interpolated_trace2, mode='full')
+        if max_lag is None:
+            # imported here, scipy.signal is only needed for the cross-correlation
+            from scipy.signal import correlate
 
-        # Find the index of the maximum correlation
-        shift_index = np.argmax(cross_corr)
-        zero_lag_index = len(trace1) - 1
-        lag = shift_index - zero_lag_index
+            # Cross-correlate the two traces
+            cross_corr = correlate(trace1, interpolated_trace2, mode='full')
+
+            # Find the index of the maximum correlation
+            shift_index = np.argmax(cross_corr)
+            zero_lag_index = len(trace1) - 1
+            lag = shift_index - zero_lag_index
+        else:
+            # only correlate the shifts of interest
+            lag = _argmax_xcorr_bounded(np.asarray(trace1, dtype=np.float64), interpolated_trace2, max_lag)
 
         # Compute time step (assumes uniform spacing)
         dt = time1[1] - time1[0]
@@ -292,7 +547,8 @@ class GantryController():
 
         return time_shift
     
-    def _align_time_based_signals(time1, trace1, time2, trace2):
+    @staticmethod
+    def _align_time_based_signals(time1, trace1, time2, trace2, max_lag=None):
         """Aligns two traces
 
         Args:
@@ -300,21 +556,33 @@ class GantryController():
             trace1 (list[float]): First datapoints.
             time2 (list[float]): Second time traces.
             trace2 (list[float]): Second datapoints.
+            max_lag (int, optional): Largest shift in samples to look for. Defaults to None, which searches all shifts.
 
         Returns:
             list[float]: The algined trace.
         """        
+        time1 = np.asarray(time1, dtype=np.float64)
+        time2 = np.asarray(time2, dtype=np.float64)
+        trace2 = np.asarray(trace2, dtype=np.float64)
+
         # Interpolate the second trace onto the time points of the first trace
         interpolated_trace2 = np.interp(time1, time2, trace2)
 
-        # Cross-correlate the two traces
-        cross_corr = correlate(trace1, interpolated_trace2, mode='full')
+        if max_lag is None:
+            # imported here, scipy.signal is only needed for the cross-correlation
+            from scipy.signal import correlate
+
+            # Cross-correlate the two traces
+            cross_corr = correlate(trace1, interpolated_trace2, mode='full')
 
-        # Find the index of the maximum correlation
-        shift_index = np.argmax(cross_corr)
+            # Find the index of the maximum correlation
+            lag = np.argmax(cross_corr) - (len(time1) - 1)
+        else:
+            # only correlate the shifts of interest
+            lag = _argmax_xcorr_bounded(np.asarray(trace1, dtype=np.float64), interpolated_trace2, max_lag)
 
-        # Calculate the time shift in samples
-        time_shift = time1[shift_index] - time1[-1]
+        # Calculate the time shift from the shift in samples (assumes uniform spacing)
+        time_shift = lag * (time1[1] - time1[0])
 
         # Interpolate the second trace again with the calculated time shift
         aligned_trace2 = np.interp(time1, time2 + time_shift, trace2)
@@ -325,27 +593,34 @@ class GantryController():
         """Align a trajectory and measurement
 
         Args:
-            traj (tuple): Trajectory tuple as given by trajectory generator.
-            measurement (tuple): Measurement as measured by executing the trajectory.
+            traj (np.ndarray): 8 x N trajectory as given by generateTrajectory.
+            measurement (tuple or np.ndarray): Measurement (t, x, v, a, theta, omega) as measured by executing the trajectory.
 
         Returns:
-            tuple: The aligned measurement
+            np.ndarray: 6 x N array (t, x, v, a, theta, omega) with the aligned measurement
         """        
         # align measurements with the trajectory based on v trace
-        measurement = list(measurement)
+        # convert once to contiguous float arrays, so np.interp doesn't have to on every call
+        t_meas = np.asarray(measurement[0], dtype=np.float64)
+        traces = np.asarray(measurement[1:6], dtype=np.float64)
         # The time shift is in fact 1 sample of trajectory points, so I don't need
         # to compute it, I can get it from there.
         # note that this is great, because otherwise I'd have had a problem
         # when it comes to the faulty data.
-        time_shift = self._find_time_shift(traj[0], traj[2], measurement[0], measurement[2])
-        logging.info("time shift is " + str(time_shift) + " seconds")
-        logging.info("difference between trajectory points" + str(traj[0][0] - traj[0][1]))
+        # the measured shift is only reported, so only compute it when it gets logged
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            time_shift = self._find_time_shift(traj[0], traj[2], t_meas, traces[1], max_lag=MAX_TIME_SHIFT_LAG)
+            logging.debug("time shift is %s seconds", time_shift)
+        logging.info("difference between trajectory points %s", traj[0][0] - traj[0][1])
         time_shift = traj[0][0] - traj[0][1]
-        for i in range(1, 6):
-            measurement[i] = np.interp(traj[0], measurement[0] + time_shift, measurement[i])
-        measurement[0] = traj[0]
-
-        return tuple(measurement)
+        shifted_time = t_meas + time_shift
+        # the aligned measurement is a single 6 x N block, with the same rows as the measurement
+        aligned = np.empty((6, len(traj[0])))
+        aligned[0] = traj[0]
+        # interpolate the five traces straight into the block
+        _interp_rows(aligned[0], shifted_time, traces, out=aligned[1:6], executor=self._compute)
+
+        return aligned
     
     @abstractmethod
     def simpleMove(self, target):
@@ -376,13 +651,13 @@ class MockGantryController(GantryController):
     overriding the executeTrajectory method
     """
 
-    def __init__(self, properties_file) -> None:
+    def __init__(self, config: dict) -> None:
         """Initialize a MockGantryController Instance
 
         Args:
-            properties_file (string): path to a properties file
+            config (dict): Configuration dictionary holding details of the gantry crane.
         """        
-        super().__init__(properties_file)
+        super().__init__(config)
 
         #TODO: at some point, we might want a mock crane that can be used for testing?
         self.crane = None  # No real crane, so set to None
@@ -390,6 +665,8 @@ class MockGantryController(GantryController):
         self.continuous_logger.start_logging()  # Start the logger, but it won't log anything
         
         self.position = 0
+        # generator for the mock measurement noise, created once instead of per trajectory
+        self._rng = np.random.default_rng()
 
     def __enter__(self):
         """Enter the runtime context of the gantry controller.
@@ -410,7 +687,7 @@ class MockGantryController(GantryController):
         return super().__exit__(exc_type, exc_value, traceback)
     
     @override
-    def connectToCrane(self, config):
+    def connectToCrane(self, config: dict = None):
         """Connect to the mock crane. This is a no-op
 
         Returns:
@@ -427,19 +704,21 @@ class MockGantryController(GantryController):
         The function sleeps until the real end time of the trajectory has passed.
 
         Args:
-            traj (tuple): The trajectory as generated by generateTrajectory.
+            traj (np.ndarray): 8 x N trajectory as generated by generateTrajectory.
 
         Returns:
-            tuple: the mock measurement with noise.
+            np.ndarray: 6 x N array (t, x, v, a, theta, omega), the mock measurement with noise.
         """        
-        curr_time = datetime.min
-        real_time = [curr_time + timedelta(seconds=ts) for ts in traj[0]]
         # sleep for the duration of the trajectory to "execute" it
         sleep(max(0, traj[0][-1]))
-        # add a bit of measurement noise to the trajectory
-        noise = np.random.normal(loc=0, scale=0.005, size = (5, len(traj[0])))
-        return (traj[0], traj[1] + noise[0,:], traj[2] + noise[1,:], traj[3] + noise[2,:], traj[4] + noise[3,:], traj[5] + noise[4,:])
-        return (real_time, traj[1], traj[2], traj[4], traj[5])
+        # the measurement is the trajectory with a bit of measurement noise,
+        # the noise is drawn straight into the measurement and the traces added in place
+        measurement = np.empty((6, len(traj[0])))
+        measurement[0] = traj[0]
+        self._rng.standard_normal(out=measurement[1:])
+        measurement[1:] *= 0.005
+        measurement[1:] += traj[1:6]
+        return measurement
     
     @override
     def simpleMove(self, target):
@@ -470,14 +749,14 @@ class PhysicalGantryController(GantryController):
     It is the class to use when a real gantry crane is connected to the system.
     """    
 
-    def __init__(self, properties_file) -> None:
+    def __init__(self, config: dict) -> None:
         """Initialize a PhysicalGantryController instance.
 
         Args:
-            properties_file (string): Path to a properties file
+            config (dict): Configuration dictionary holding details of the gantry crane.
         """        
-        super().__init__(properties_file)
-        self.crane = self.connectToCrane(properties_file)
+        super().__init__(config)
+        self.crane = self.connectToCrane()
         self.position = self.crane.cartStepper.getPositionMm()
 
         # give crane to logger.
@@ -504,15 +783,17 @@ class PhysicalGantryController(GantryController):
         return super().__exit__(exc_type, exc_value, traceback)
 
     @override
-    def connectToCrane(self, config: dict):
+    def connectToCrane(self, config: dict = None):
         """Connect to the physical crane.
 
         Args:
-            config (dict): The configuration dictionary
+            config (dict, optional): The configuration dictionary. Defaults to the one given at initialization.
 
         Returns:
             Crane: a Crane instance
         """
+        if config is None:
+            config = self.config
         crane = PhysicalCrane(config)
         return crane
 
@@ -539,17 +820,18 @@ class PhysicalGantryController(GantryController):
         omega : angular velocity
 
         Args:
-            traj (tuple): The trajectory as generated by generateTrajectory.
+            traj (np.ndarray): 8 x N trajectory as generated by generateTrajectory.
 
         Returns:
             tuple: the measured trajectory
         """        
-        # convert trajectory to waypoints executable by the crane class
-        waypoints = [Waypoint(t, x*1000, v*1000, a*1000) for t, x, v, a in \
-                     zip(traj[0], traj[1], traj[2], traj[3])]
+        # convert trajectory to waypoints executable by the crane class,
+        # as a 4 x N array with rows t in s, x, v and a in mm based units
+        waypoints = np.asarray(traj[:4], dtype=np.float64) * 1000
+        waypoints[0] = traj[0]
 
         # set waypoints in crane.
-        self.crane.waypoints = waypoints
+        self.crane.setWaypoints(waypoints)
 
         # execute the waypoints (starting condition check?)
         ret = self.crane.executeWaypointsPosition()
@@ -575,14 +857,16 @@ class PhysicalGantryController(GantryController):
         Returns:
             float: the exact final position
         """        
+        # cache stepper and conversion factor, they don't change during the move.
+        hoist_stepper = self.crane.hoistStepper
+        mm_to_counts = hoist_stepper.mm_to_counts
         # inverts direction.
-        print(f"pos in counts: {self.crane.hoistStepper.mm_to_counts * pos * 1000}")
-        tgt = int(458752 - self.crane.hoistStepper.mm_to_counts * pos * 1000)
-        self.crane.hoistStepper.setPosition(tgt)
-        while (round(self.crane.hoistStepper.getPosition(), -2) != round(tgt, -2)):
-            print(f"position not yet reached: {round(self.crane.hoistStepper.getPosition(), -2)}, {tgt}")
-            sleep(1)
-        return (458752 - self.crane.hoistStepper.getPosition())/self.crane.hoistStepper.mm_to_counts/1000
+        logging.debug("Hoist position in counts: %s", mm_to_counts * pos * 1000)
+        tgt = int(458752 - mm_to_counts * pos * 1000)
+        hoist_stepper.setPosition(tgt)
+        logging.debug("Waiting for position %s", tgt)
+        position = _wait_until_reached(hoist_stepper, tgt)
+        return (458752 - position)/mm_to_counts/1000
     
     @override
     def simpleMove(self, target):
@@ -594,12 +878,15 @@ class PhysicalGantryController(GantryController):
         Returns:
             float: The actual end position
         """
-        self.crane.gantryStepper.setPositionMode()
-        self.crane.gantryStepper.setAccelLimit(2147483647)
-        self.crane.gantryStepper.setVelocityLimit(2000)
-        self.crane.gantryStepper.setPosition(target * 1000*self.crane.gantryStepper.mm_to_counts)
+        # cache stepper and target in counts, they don't change during the move.
+        stepper = self.crane.cartStepper
+        mm_to_counts = stepper.mm_to_counts
+        tgt_counts = int(target * 1000 * mm_to_counts)
+        stepper.setPositionMode()
+        stepper.setAccelLimit(2147483647)
+        stepper.setVelocityLimit(2000)
+        stepper.setPosition(tgt_counts)
         # wait for move to complete.
-        while (round(self.crane.gantryStepper.getPosition(), -2) != round(target * 1000*self.crane.gantryStepper.mm_to_counts, -2)):
-            sleep(0.1)
+        position = _wait_until_reached(stepper, tgt_counts)
         
-        return self.crane.gantryStepper.getPosition()/self.crane.gantryStepper.mm_to_counts/1000
+        return position/mm_to_counts/1000
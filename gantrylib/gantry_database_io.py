@@ -1,8 +1,293 @@
 from abc import ABC, abstractmethod
-from datetime import datetime
-from typing import List
+import atexit
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+import numpy as np
 import psycopg
+from psycopg import sql
 import logging
+import struct
+import threading
+
+# binary COPY file header: signature, flags and header extension length
+_PGCOPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack(">ii", 0, 0)
+# binary COPY file trailer: a field count of -1
+_PGCOPY_TRAILER = struct.pack(">h", -1)
+# postgres timestamps count microseconds from 2000-01-01
+_PG_EPOCH = np.datetime64('2000-01-01T00:00:00', 'us')
+_PG_EPOCH_DATETIME = datetime(2000, 1, 1)
+_ONE_MICROSECOND = timedelta(microseconds=1)
+
+def _to_timestamps(t_start, ts):
+    """Convert relative sample times to absolute timestamps
+
+    Args:
+        t_start (datetime): The start time.
+        ts (list[float]): Sample times in seconds relative to t_start.
+
+    Returns:
+        np.ndarray: datetime64[us] array of timestamps.
+    """
+    # round to microseconds like timedelta does, astype alone would truncate
+    offsets = np.round(np.asarray(ts, dtype=np.float64) * 1e6).astype('timedelta64[us]')
+    return np.datetime64(t_start, 'us') + offsets
+
+def _to_pg_timestamps(ts) -> np.ndarray:
+    """Convert naive timestamps to postgres binary timestamps
+
+    Args:
+        ts (list[datetime] or np.ndarray): Naive timestamps, either datetimes or a datetime64 array.
+
+    Returns:
+        np.ndarray: int64 array of microseconds since 2000-01-01.
+    """
+    if isinstance(ts, np.ndarray) and ts.dtype.kind == 'M':
+        ts = ts.astype('datetime64[us]', copy=False)
+        return (ts - _PG_EPOCH).astype(np.int64)
+    # numpy converts datetime objects one at a time and slowly,
+    # subtracting them from the epoch in python is several times faster.
+    return np.array([(t - _PG_EPOCH_DATETIME) // _ONE_MICROSECOND for t in ts], dtype=np.int64)
+
+def _to_pg_timestamptz(ts: np.ndarray, tz) -> np.ndarray:
+    """Convert postgres binary timestamps to binary timestamptz values
+
+    The naive timestamps are read as local times in tz, like the server casts
+    timestamp to timestamptz in a session with that time zone. Like the server, a time
+    repeated when the clocks go back gets the offset after the transition, and a time
+    skipped when they go forward the offset before it.
+
+    Args:
+        ts (np.ndarray): int64 microseconds since 2000-01-01, as returned by _to_pg_timestamps.
+        tz (tzinfo): The session's time zone, e.g. connection.info.timezone.
+
+    Returns:
+        np.ndarray: int64 microseconds since 2000-01-01 UTC.
+    """
+    def utc_offset(t):
+        local = _PG_EPOCH_DATETIME + timedelta(microseconds=t)
+        # both cases are the smaller of the offsets of the two folds
+        return min(local.replace(tzinfo=tz, fold=0).utcoffset(),
+                   local.replace(tzinfo=tz, fold=1).utcoffset()) // _ONE_MICROSECOND
+    if len(ts) == 0:
+        return ts.astype(np.int64)
+    first = utc_offset(int(ts.min()))
+    if first == utc_offset(int(ts.max())):
+        return ts - first
+    # the offset changes in between, look it up once per distinct second
+    seconds = ts // 1_000_000
+    unique_seconds, inverse = np.unique(seconds, return_inverse=True)
+    offsets = np.array([utc_offset(s * 1_000_000) for s in unique_seconds.tolist()], dtype=np.int64)
+    return ts - offsets[inverse]
+
+def _pgcopy_binary(ts, columns: dict, keys: tuple = ()) -> bytearray:
+    """Build a binary COPY payload for (ts, *keys, quantity, *values) rows
+
+    The rows of one quantity all have the same size, so the payload is allocated
+    once and every quantity is filled in as a packed numpy record array viewing
+    its part of the buffer, instead of being written row by row.
+
+    Args:
+        ts (np.ndarray): int64 timestamps as returned by _to_pg_timestamps.
+        columns (dict): Maps every quantity name to its values, one per timestamp, or to a
+            k x N array of them for k float8 columns per row.
+        keys (tuple): int4 values copied between the timestamp and the quantity, such as
+            machine and run IDs. Each key is either one int for every row or an array
+            with one int per timestamp.
+
+    Returns:
+        bytearray: The complete COPY payload, including header and trailer.
+    """
+    key_fields = [field for i in range(len(keys)) for field in ((f'key{i}_len', '>i4'), (f'key{i}', '>i4'))]
+    columns = {qty: np.atleast_2d(np.asarray(values, dtype=np.float64)) for qty, values in columns.items()}
+    row_types = {qty: np.dtype([('fields', '>i2'),
+                                ('ts_len', '>i4'), ('ts', '>i8'),
+                                *key_fields,
+                                ('quantity_len', '>i4'), ('quantity', f'S{len(qty.encode())}'),
+                                *[field for i in range(len(values))
+                                  for field in ((f'value{i}_len', '>i4'), (f'value{i}', '>f8'))]])
+                 for qty, values in columns.items()}
+    size = len(_PGCOPY_HEADER) + len(_PGCOPY_TRAILER) + len(ts) * sum(dt.itemsize for dt in row_types.values())
+    payload = bytearray(size)
+    payload[:len(_PGCOPY_HEADER)] = _PGCOPY_HEADER
+    offset = len(_PGCOPY_HEADER)
+    for qty, values in columns.items():
+        rows = np.ndarray(len(ts), dtype=row_types[qty], buffer=payload, offset=offset)
+        rows['fields'] = 2 + len(keys) + len(values)
+        rows['ts_len'] = 8
+        rows['ts'] = ts
+        for i, key in enumerate(keys):
+            rows[f'key{i}_len'] = 4
+            rows[f'key{i}'] = key
+        rows['quantity_len'] = len(qty.encode())
+        rows['quantity'] = qty.encode()
+        for i, value in enumerate(values):
+            rows[f'value{i}_len'] = 8
+            rows[f'value{i}'] = value
+        offset += rows.nbytes
+    payload[offset:] = _PGCOPY_TRAILER
+    return payload
+
+def _read_copy(copy) -> bytearray:
+    """Collect the output of a COPY ... TO STDOUT in one buffer
+
+    The blocks are appended as they arrive and can be freed right away, instead of
+    all being kept until joining them copies everything once more.
+
+    Args:
+        copy (psycopg.Copy): The COPY to read, or any iterable of blocks.
+
+    Returns:
+        bytearray: The complete output, e.g. for _from_pgcopy_binary.
+    """
+    payload = bytearray()
+    for block in copy:
+        payload += block
+    return payload
+
+def _from_pgcopy_binary(payload, fields: dict) -> np.ndarray:
+    """Read a binary COPY payload of fixed size, non-NULL fields as a record array
+
+    Every row has the same size, so the payload is viewed as a packed numpy record
+    array instead of being parsed row by row.
+
+    Args:
+        payload (bytes or bytearray): The output of COPY ... TO STDOUT (FORMAT BINARY), header and trailer included.
+        fields (dict): Maps the name of every column to its big-endian numpy type, such as
+            '>i8' for timestamps (microseconds since 2000-01-01), '>f8' for float8 and '>i4' for int4.
+
+    Returns:
+        np.ndarray: Record array with a field per column, still in the payload's byte order.
+    """
+    header_size = len(_PGCOPY_HEADER) + struct.unpack_from(">i", payload, len(_PGCOPY_HEADER) - 4)[0]
+    row_type = np.dtype([('fields', '>i2'),
+                         *[field for name, dtype in fields.items()
+                           for field in ((f'{name}_len', '>i4'), (name, dtype))]])
+    n_rows, rest = divmod(len(payload) - header_size - len(_PGCOPY_TRAILER), row_type.itemsize)
+    if rest:
+        raise ValueError("Rows of the COPY payload don't match the given fields")
+    rows = np.frombuffer(payload, dtype=row_type, count=n_rows, offset=header_size)
+    if np.any(rows['fields'] != len(fields)):
+        raise ValueError("Rows of the COPY payload don't match the given fields")
+    for name, dtype in fields.items():
+        # a NULL has length -1 and no data, which would shift all following rows
+        if np.any(rows[f'{name}_len'] != np.dtype(dtype).itemsize):
+            raise ValueError(f"Column {name} has NULLs or values of another size")
+    return rows
+
+# idle connections per connection string, shared by all PostgresDatabase instances
+# in the process so a new controller doesn't pay for a fresh connection and login.
+_idle_connections = {}
+_idle_connections_lock = threading.Lock()
+# maximum number of idle connections kept per connection string
+MAX_IDLE_CONNECTIONS = 8
+
+def _acquire_connection(conninfo: str) -> psycopg.Connection:
+    """Get an open connection from the pool, or open a new one
+
+    Args:
+        conninfo (str): The connection string.
+
+    Returns:
+        psycopg.Connection: An open connection.
+    """
+    with _idle_connections_lock:
+        idle = _idle_connections.get(conninfo, [])
+        while idle:
+            conn = idle.pop()
+            if not conn.closed:
+                return conn
+    # keepalives avoid the connection being dropped while it sits idle in the pool
+    return psycopg.connect(conninfo, keepalives=1, keepalives_idle=30)
+
+def _release_connection(conninfo: str, conn: psycopg.Connection) -> None:
+    """Return a connection to the pool, closing it if it is broken or the pool is full
+
+    Uncommitted work is rolled back, as closing the connection would have done.
+
+    Args:
+        conninfo (str): The connection string the connection was opened with.
+        conn (psycopg.Connection): The connection to return.
+    """
+    if conn.closed:
+        return
+    try:
+        conn.rollback()
+    except psycopg.Error:
+        conn.close()
+        return
+    with _idle_connections_lock:
+        idle = _idle_connections.setdefault(conninfo, [])
+        if len(idle) < MAX_IDLE_CONNECTIONS:
+            idle.append(conn)
+            return
+    conn.close()
+
+# connection of a simulation or validation worker process, kept open across the jobs it runs.
+# every pool has its own worker processes, so one connection per process is enough.
+_worker_conn = None
+
+def _init_worker_connection(dbaddr=None, setup=None) -> None:
+    """Open the connection of a worker process, and close it when the process exits
+
+    Meant to be called from the initializer of a process pool. If connecting fails a warning
+    is logged and the first job connects instead, a failing initializer would break the whole pool.
+
+    Args:
+        dbaddr (str, optional): The connection string, no connection is opened if None.
+        setup (callable, optional): Called with every newly opened connection, see _worker_connection.
+    """
+    atexit.register(_close_worker_connection)
+    if dbaddr is not None:
+        try:
+            with _worker_connection(dbaddr, setup):
+                pass
+        except psycopg.Error as e:
+            logging.warning("Worker could not connect to the database: %s", e)
+
+def _close_worker_connection() -> None:
+    """Close the connection of the worker process, if it has one"""
+    global _worker_conn
+    if _worker_conn is not None:
+        _worker_conn.close()
+        _worker_conn = None
+
+@contextmanager
+def _worker_connection(dbaddr: str, setup=None):
+    """The connection of the worker process, opened on first use or if it was lost
+
+    Like the context of psycopg.connect it commits on success and rolls back on errors, but it
+    keeps the connection, and the statements psycopg prepared on it, for the next job.
+
+    Args:
+        dbaddr (str): The connection string.
+        setup (callable, optional): Called with a newly opened connection before it is used,
+            e.g. to create temporary tables. Its work is committed.
+
+    Yields:
+        psycopg.Connection: The open connection.
+    """
+    global _worker_conn
+    if _worker_conn is None or _worker_conn.closed:
+        _worker_conn = psycopg.connect(dbaddr)
+        if setup is not None:
+            setup(_worker_conn)
+            _worker_conn.commit()
+    try:
+        yield _worker_conn
+    except BaseException:
+        if not _worker_conn.closed:
+            _worker_conn.rollback()
+        raise
+    _worker_conn.commit()
+
+# quantities of the rows of a trajectory, after its time row
+TRAJECTORY_QUANTITIES = ('position', 'velocity', 'acceleration',
+                         'angular position', 'angular velocity',
+                         'angular acceleration', 'force')
+
+# quantities of the continuously logged crane state, in the order of the values of a state row
+STATE_QUANTITIES = ('position', 'velocity', 'position vertical', 'velocity vertical',
+                    'angular position', 'angular velocity', 'windspeed')
 
 class DatabaseInterface(ABC):
     """Abstract base class for database operations"""
@@ -27,11 +312,28 @@ class DatabaseInterface(ABC):
         """Store run information"""
         pass
 
+    @abstractmethod
+    def create_run(self, machine_id: int, start_time: datetime) -> int:
+        """Store a new run with the next available run ID and return that ID"""
+        pass
+
     @abstractmethod
     def store_trajectory(self, machine_id: int, run_id: int, trajectory: tuple):
         """Store trajectory data"""
         pass
 
+    @abstractmethod
+    def store_trajectory_array(self, machine_id: int, run_id: int, ts: np.ndarray, columns: dict):
+        """Store trajectory data given as one array per quantity
+
+        Args:
+            machine_id (int): The machine ID.
+            run_id (int): The run ID.
+            ts (np.ndarray): datetime64 timestamps of the samples.
+            columns (dict): Maps quantity names (see TRAJECTORY_QUANTITIES) to arrays of values.
+        """
+        pass
+
     @abstractmethod
     def store_measurement(self, machine_id: int, run_id: int, measurement: tuple):
         """Store measurement data"""
@@ -42,27 +344,79 @@ class DatabaseInterface(ABC):
         """Store state data"""
         pass
 
+    @abstractmethod
+    def store_state_array(self, machine_id: int, run_id: int, ts: np.ndarray, columns: dict):
+        """Store state data given as one array per quantity
+
+        Args:
+            machine_id (int): The machine ID.
+            run_id (int): The run ID.
+            ts (np.ndarray): datetime64 timestamps of the samples.
+            columns (dict): Maps quantity names (see STATE_QUANTITIES) to arrays of values.
+
+        Raises:
+            Exception: If the data could not be stored, so the caller can keep it and retry.
+        """
+        pass
+
     @abstractmethod
     def commit(self):
         """Commit current transaction"""
         pass
 
+    @abstractmethod
+    def rollback(self):
+        """Roll back current transaction"""
+        pass
+
+    @contextmanager
+    def transaction(self):
+        """Commit everything stored in the block at once, or nothing if the block raises
+
+        Without auto_commit, nothing is committed until commit is called, so a whole
+        run (run, trajectory and measurement) costs a single commit.
+        """
+        try:
+            yield self
+        except BaseException:
+            self.rollback()
+            raise
+        self.commit()
+
     @abstractmethod
     def cleanup_continuous_logging(self, start_time: datetime, machine_id: int) -> None:
         """Remove continuous logging data from start_time onwards"""
         pass
 
 class PostgresDatabase(DatabaseInterface):
-    """PostgreSQL implementation of DatabaseInterface"""
+    """PostgreSQL implementation of DatabaseInterface
+
+    Every instance borrows one connection from the process-wide pool on connect
+    and returns it on disconnect. A run, its trajectory and its measurement are
+    written over that one connection, since they form a single transaction and
+    the trajectory and measurement rows reference the not yet committed run.
+    Work that may run concurrently (continuous logging, simulation, validation)
+    uses its own PostgresDatabase, and so its own connection.
+    """
 
     def __init__(self, host: str, dbname: str, user: str, password: str, auto_commit: bool = False):
         self.connection_string = f"host={host} dbname={dbname} user={user} password={password}"
         self.conn = None
+        self._cursor = None
         self.auto_commit = auto_commit
 
     def connect(self):
         try:
-            self.conn = psycopg.connect(self.connection_string)
+            self.conn = _acquire_connection(self.connection_string)
+            # samples are copied into this table first, see _copy_samples. temporary tables live
+            # as long as the connection, so pooled connections already have it.
+            self.conn.execute(
+                """CREATE TEMPORARY TABLE IF NOT EXISTS sample_staging
+                   (ts timestamp NOT NULL, quantity text NOT NULL, value float8)"""
+            )
+            self.conn.commit()
+            # one cursor serves all queries and copies of this instance, it is closed on disconnect
+            self._cursor = self.conn.cursor()
             logging.info("Connected to PostgreSQL database")
         except Exception as e:
             logging.error(f"Failed to connect to database: {e}")
@@ -71,103 +425,147 @@ class PostgresDatabase(DatabaseInterface):
     def disconnect(self):
         if self.conn:
             try:
-                self.conn.close()
+                if self._cursor is not None:
+                    self._cursor.close()
+                _release_connection(self.connection_string, self.conn)
                 logging.info("Disconnected from PostgreSQL database")
-            except Exception as e:
+            except (psycopg.Error, OSError) as e:
                 logging.error(f"Error disconnecting from database: {e}")
+            # the connection may be handed out again, don't keep using it
+            self._cursor = None
+            self.conn = None
+
+    def _copy_samples(self, cur, table: str, machine_id: int, run_id: int, ts, columns: dict):
+        """Copy samples into a (ts, machine_id, run_id, quantity, value) table
+
+        Only ts, quantity and value are sent, into the staging table. The machine
+        and run IDs are filled in once by the INSERT that moves them to the table.
+        With auto_commit, this also commits.
+
+        Args:
+            cur (psycopg.Cursor): The cursor to use.
+            table (str): The table to store the samples in, trajectory or measurement.
+            machine_id (int): The machine ID.
+            run_id (int): The run ID.
+            ts (list[datetime] or np.ndarray): Naive timestamps of the samples.
+            columns (dict): Maps every quantity name to its values, one per timestamp.
+        """
+        payload = _pgcopy_binary(_to_pg_timestamps(ts), columns)
+        with cur.copy("COPY sample_staging (ts, quantity, value) FROM stdin (FORMAT BINARY)") as copy:
+            copy.write(payload)
+        # inserting a timestamp into a timestamptz column interprets it in the session
+        # time zone, just like the text COPY of naive datetimes did. with auto_commit the
+        # COMMIT is pipelined with the INSERT, so they take a single round trip.
+        with self.conn.pipeline():
+            cur.execute(
+                sql.SQL("""WITH staged AS (DELETE FROM sample_staging RETURNING ts, quantity, value)
+                           INSERT INTO {} (ts, machine_id, run_id, quantity, value)
+                           SELECT ts, %s, %s, quantity, value FROM staged""").format(sql.Identifier(table)),
+                (machine_id, run_id)
+            )
+            if self.auto_commit:
+                self.conn.commit()
 
     def get_next_run_id(self, machine_id: int) -> int:
         if not self.conn:
             return 0
         
-        with self.conn.cursor() as cur:
-            cur.execute("SELECT MAX(run_id) FROM run WHERE machine_id = %s", (machine_id,))
-            try:
-                run_id = cur.fetchall()[0][0] + 1
-            except Exception:
-                # if an exception occurs, there simply aren't any runs yet.
-                # so add run number 0.
-                run_id = 0
-        return run_id
+        cur = self._cursor
+        cur.execute("SELECT MAX(run_id) FROM run WHERE machine_id = %s", (machine_id,))
+        row = cur.fetchone()
+        # MAX returns NULL if there aren't any runs yet, so start at run number 0.
+        return (row[0] if row and row[0] is not None else -1) + 1
 
     def store_run(self, run_id: int, machine_id: int, start_time: datetime):
         if not self.conn:
             return
         
-        with self.conn.cursor() as cur:
-            cur.execute(
-                "INSERT INTO run (run_id, machine_id, starttime) VALUES (%s, %s, %s)",
-                (run_id, machine_id, start_time)
-            )
+        self._cursor.execute(
+            "INSERT INTO run (run_id, machine_id, starttime) VALUES (%s, %s, %s)",
+            (run_id, machine_id, start_time)
+        )
         if self.auto_commit:
             self.conn.commit()
 
-    def store_trajectory(self, machine_id: int, run_id: int, trajectory: tuple):
+    def create_run(self, machine_id: int, start_time: datetime) -> int:
         if not self.conn:
-            return
+            return 0
 
-        with self.conn.cursor() as cur:
-            with cur.copy("COPY trajectory (ts, machine_id, run_id, quantity, value) FROM stdin") as copy:
-                quantities = ['position', 'velocity', 'acceleration', 
-                            'angular position', 'angular velocity',
-                            'angular acceleration', 'force']
-                for idx, qty in enumerate(quantities, 1):
-                    for (t, data) in zip(trajectory[0], trajectory[idx]):
-                        copy.write_row((t, machine_id, run_id, qty, data))
+        # allocate the run ID and insert the run in a single round-trip
+        cur = self._cursor
+        cur.execute(
+            """INSERT INTO run (run_id, machine_id, starttime)
+               SELECT COALESCE(MAX(run_id), -1) + 1, %s, %s FROM run WHERE machine_id = %s
+               RETURNING run_id""",
+            (machine_id, start_time, machine_id)
+        )
+        run_id = cur.fetchone()[0]
         if self.auto_commit:
             self.conn.commit()
+        return run_id
+
+    def store_trajectory(self, machine_id: int, run_id: int, trajectory: tuple):
+        if not self.conn:
+            return
+
+        self.store_trajectory_array(machine_id, run_id, trajectory[0],
+                                    dict(zip(TRAJECTORY_QUANTITIES, trajectory[1:])))
+
+    def store_trajectory_array(self, machine_id: int, run_id: int, ts: np.ndarray, columns: dict):
+        if not self.conn:
+            return
+
+        self._copy_samples(self._cursor, "trajectory", machine_id, run_id, ts, columns)
 
     def store_measurement(self, machine_id: int, run_id: int, measurement: tuple):
         if not self.conn:
             return
 
-        with self.conn.cursor() as cur:
-            with cur.copy("COPY measurement (ts, machine_id, run_id, quantity, value) FROM stdin") as copy:
-                quantities = ['position', 'velocity', 'acceleration', 
-                            'angular position', 'angular velocity']
-                for idx, qty in enumerate(quantities, 1):
-                    for (ts, data) in zip(measurement[0], measurement[idx]):
-                        copy.write_row((ts, machine_id, run_id, qty, data))
-        if self.auto_commit:
-            self.conn.commit()
+        quantities = ['position', 'velocity', 'acceleration', 
+                    'angular position', 'angular velocity']
+        self._copy_samples(self._cursor, "measurement", machine_id, run_id, measurement[0],
+                           dict(zip(quantities, measurement[1:])))
     
     def store_state(self, machine_id: int, run_id: int, state: tuple):
         if not self.conn:
             return
         
-        state = tuple(map(list, zip(*state)))  # Convert list of tuples to tuple of lists for copy
+        # state holds (ts, *values) rows, split it into the time column and a rows x quantities array
+        ts = [row[0] for row in state]
+        values = np.array([row[1:] for row in state], dtype=np.float64).reshape(len(state), len(STATE_QUANTITIES))
+        self.store_state_array(machine_id, run_id, ts, dict(zip(STATE_QUANTITIES, values.T)))
+
+    def store_state_array(self, machine_id: int, run_id: int, ts: np.ndarray, columns: dict):
+        if not self.conn:
+            return
 
         try:
-            with self.conn.cursor() as cur:
-                with cur.copy("COPY measurement (ts, machine_id, run_id, quantity, value) FROM stdin") as copy:
-                    quantities = ['position', 'velocity', 'position vertical', 'velocity vertical',
-                                'angular position', 'angular velocity', 'windspeed']
-                    for idx, qty in enumerate(quantities, 1):
-                        for (ts, data) in zip(state[0], state[idx]):
-                            copy.write_row((ts, machine_id, run_id, qty, data))
+            self._copy_samples(self._cursor, "measurement", machine_id, run_id, ts, columns)
         except Exception as e:
             self.conn.rollback()
             logging.error(f"Error storing state data: {e}")
-            
-        if self.auto_commit:
-            self.conn.commit()
+            # the state logger retries or spills the batch
+            raise
 
     def commit(self):
         self.conn.commit()
 
+    def rollback(self):
+        if self.conn:
+            self.conn.rollback()
+
     def cleanup_continuous_logging(self, start_time: datetime, machine_id: int) -> None:
         """Remove all measurements with run_id=0 from start_time onwards"""
         if not self.conn:
             return
         
-        with self.conn.cursor() as cur:
-            cur.execute(
-                """DELETE FROM measurement
-                   WHERE run_id = 0
-                   AND ts >= %s
-                   AND machine_id = %s""",
-                (start_time, machine_id)
-            )
+        self._cursor.execute(
+            """DELETE FROM measurement
+               WHERE run_id = 0
+               AND ts >= %s
+               AND machine_id = %s""",
+            (start_time, machine_id)
+        )
         if self.auto_commit:
             self.conn.commit()
 
@@ -185,21 +583,33 @@ class MockDatabase(DatabaseInterface):
     def store_run(self, run_id: int, machine_id: int, start_time):
         pass
 
+    def create_run(self, machine_id: int, start_time) -> int:
+        return 0
+
     def store_trajectory(self, machine_id: int, run_id: int, trajectory: tuple):
         pass
 
+    def store_trajectory_array(self, machine_id: int, run_id: int, ts: np.ndarray, columns: dict):
+        pass
+
     def store_measurement(self, machine_id: int, run_id: int, measurement: tuple):
         pass
 
     def commit(self):
         pass
 
+    def rollback(self):
+        pass
+
     def cleanup_continuous_logging(self, start_time: datetime, machine_id: int) -> None:
         pass
 
     def store_state(self, machine_id: int, run_id: int, state: tuple):
         pass
 
+    def store_state_array(self, machine_id: int, run_id: int, ts: np.ndarray, columns: dict):
+        pass
+
 class NullDatabase(DatabaseInterface):
     """Null object pattern implementation for when no database is needed"""
     def connect(self):
@@ -216,10 +626,18 @@ class NullDatabase(DatabaseInterface):
         logging.warning("NullDatabase: store_run called, but no action taken")
         pass
 
+    def create_run(self, machine_id: int, start_time) -> int:
+        logging.warning("NullDatabase: create_run called, returning 0")
+        return 0
+
     def store_trajectory(self, machine_id: int, run_id: int, trajectory: tuple):
         logging.warning("NullDatabase: store_trajectory called, but no action taken")
         pass
 
+    def store_trajectory_array(self, machine_id: int, run_id: int, ts: np.ndarray, columns: dict):
+        logging.warning("NullDatabase: store_trajectory_array called, but no action taken")
+        pass
+
     def store_measurement(self, machine_id: int, run_id: int, measurement: tuple):
         logging.warning("NullDatabase: store_measurement called, but no action taken")
         pass
@@ -228,10 +646,18 @@ class NullDatabase(DatabaseInterface):
         logging.warning("NullDatabase: commit called, but no action taken")
         pass
 
+    def rollback(self):
+        logging.warning("NullDatabase: rollback called, but no action taken")
+        pass
+
     def cleanup_continuous_logging(self, start_time: datetime, machine_id: int) -> None:
         logging.warning("NullDatabase: cleanup_continuous_logging called, but no action taken")
         pass
 
     def store_state(self, machine_id: int, run_id: int, state: tuple):
         logging.warning("NullDatabase: store_state called, but no action taken")
+        pass
+
+    def store_state_array(self, machine_id: int, run_id: int, ts: np.ndarray, columns: dict):
+        logging.warning("NullDatabase: store_state_array called, but no action taken")
         pass
\ No newline at end of file
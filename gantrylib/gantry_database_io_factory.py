@@ -18,6 +18,9 @@ class GantryDatabaseFactory:
             db_type (DatabaseType): Type of database to create
             config (dict): Database configuration parameters
 
+        Postgres databases are created without auto_commit, callers commit once per
+        run with commit() or by storing it inside a transaction() block.
+
         Returns:
             DatabaseInterface: Instance of database interface implementation
 
@@ -29,7 +32,8 @@ class GantryDatabaseFactory:
                 host=config["db_address"],
                 dbname=config["db_name"],
                 user=config["db_user"],
-                password=config["db_password"]
+                password=config["db_password"],
+                auto_commit=False
             )
         elif db_type == DatabaseType.MOCK:
             # For testing purposes
@@ -1,7 +1,25 @@
+import math
+from bisect import bisect_right
 from scipy.integrate import solve_ivp
 import numpy as np
 from scipy.constants import g
-from scipy.interpolate import interp1d
+
+def _zero_order_hold(tu, u):
+    """Build a previous-sample lookup of u over tu.
+
+    Equivalent to interp1d(tu, u, kind='zero') with constant extrapolation
+    on both ends, without interp1d's per-call overhead. The lookup is called
+    with one scalar time at a time, for which bisecting a list is several
+    times faster than np.searchsorted and returns a plain float.
+    """
+    tu = np.asarray(tu, dtype=np.float64).tolist()
+    u = np.asarray(u, dtype=np.float64).tolist()
+    last = len(u) - 1
+
+    def f(t):
+        return u[min(max(bisect_right(tu, t) - 1, 0), last)]
+
+    return f
 
 class GantrySimulation():
 
@@ -20,7 +38,7 @@ class GantrySimulation():
     def sign(self, num):
         return -1 if num < 0 else 1
 
-    def odefun(self, t, y, f, v_tgt):
+    def odefun(self, t, y, f):
         """
         Parameters
         ----------
@@ -30,11 +48,9 @@ class GantrySimulation():
             y[1] = v (that's dx/dt)
             y[2] = theta
             y[3] = omega (that's dtheta/dt)
-        tu : time of u vector
-        u : input vector
+        f : input force as a function of time
         """
         u = f(t)
-        v_tgt_smpl = v_tgt(t+0.01)
 
         # local assignment to save writing self. every time
         mc = self.mc
@@ -42,52 +58,144 @@ class GantrySimulation():
         rd = 0 # is in the formula for when you want to have adjustable rope
 
         # state vector:
-        x = y[0]
-        v = y[1] # dx/dt
-        theta = y[2]
-        omega = y[3] # dtheta/dt
-
-        rounding = 5
+        # unpack a list, indexing the array gives numpy scalars that are slower to compute with
+        x, v, theta, omega = y.tolist() # v = dx/dt, omega = dtheta/dt
 
         a = u/mc
-        # if round(v, rounding) < np.round(v_tgt_smpl, rounding):
-        #     # when v has not hit v_tgt yet, keep accelerating at the maximum rate
-        #     a = u/mc
-        #     #a = self.a_max
-        # elif round(v, rounding) > np.round(v_tgt_smpl, rounding):
-        #     # for deceleration follow u without limits
-        #     a = u/mc # dv/dt
-        # else:
-        # # if we are within range of v_target and don't need to decelerate, just set 0
-        #     a = 0
-        #     # a = u/mc # dv/dt
-        #     # a = self.a_max * self.sign(a) if min(abs(a), self.a_max) == self.a_max else a
-             
-        alpha = -1*g*mc*np.sin(theta)/r - 2*mc*omega*rd/r\
-                - a*np.cos(theta)/(mc*r)
+
+        # theta is a scalar, math.sin/cos are much cheaper than their numpy versions for that
+        alpha = -1*g*mc*math.sin(theta)/r - 2*mc*omega*rd/r\
+                - a*math.cos(theta)/(mc*r)
         
-        dy = np.zeros(np.size(y))
-        dy[0] = self.v_max * self.sign(v) if min(abs(v), self.v_max) == self.v_max else v
-        dy[1] = a
-        dy[2] = omega
-        dy[3] = alpha
+        v_max = self.v_max
+        dx = math.copysign(v_max, v) if abs(v) >= v_max else v
 
-        return dy
+        # solve_ivp converts the result to an array itself, a tuple avoids
+        # allocating and filling a temporary one on every call
+        return (dx, a, omega, alpha)
 
+    def jacobian(self, t, y, f):
+        """
+        Analytic jacobian d(odefun)/dy, see odefun for the state vector.
+        """
+        mc = self.mc
+        r = self.r
+        rd = 0
+
+        v = y[1]
+        theta = y[2]
+        a = f(t)/mc
+
+        jac = np.zeros((4, 4))
+        jac[0, 1] = 1.0 if abs(v) < self.v_max else 0.0
+        jac[2, 3] = 1.0
+        jac[3, 2] = -1*g*mc*math.cos(theta)/r + a*math.sin(theta)/(mc*r)
+        jac[3, 3] = -2*mc*rd/r
+
+        return jac
     
-    def simulate(self, y_init, t, tu, u, v):
+    def simulate(self, y_init, t, tu, u):
         """
         simulate the gantrycrane
 
         """
-        f = interp1d(tu, u, kind='zero')
-        v_tgt = interp1d(tu, v, kind='zero', bounds_error=False, fill_value="extrapolate")
-        sol = solve_ivp(lambda t, y: self.odefun(t, y, f, v_tgt),\
-                                  [t[0], t[-1]], y_init, t_eval=t)
+        f = _zero_order_hold(tu, u)
+        sol = solve_ivp(lambda t, y: self.odefun(t, y, f),\
+                                  [t[0], t[-1]], y_init, t_eval=t, method='LSODA',
+                                  jac=lambda t, y: self.jacobian(t, y, f))
 
         sol.y[1] = np.clip(sol.y[1], -self.v_max, self.v_max)      
         return sol
 
+    def odefun_batch(self, t, y, f):
+        """
+        odefun for a batch of replications that only differ in rope length and initial state.
+
+        Parameters
+        ----------
+        t : current time step
+        y : state vectors of all replications after another, (x, v, theta, omega) of the
+            first replication, then of the second one and so on.
+        f : input force as a function of time, the same for all replications
+        """
+        u = f(t)
+
+        mc = self.mc
+        r = self.r # scalar or one rope length per replication
+        rd = 0
+
+        y = y.reshape(-1, 4)
+        v = y[:, 1]
+        theta = y[:, 2]
+        omega = y[:, 3]
+
+        a = u/mc
+
+        dy = np.empty_like(y)
+        # clipping v is the same velocity limit as in odefun
+        np.clip(v, -self.v_max, self.v_max, out=dy[:, 0])
+        dy[:, 1] = a
+        dy[:, 2] = omega
+        dy[:, 3] = -1*g*mc*np.sin(theta)/r - 2*mc*omega*rd/r\
+                   - a*np.cos(theta)/(mc*r)
+        return dy.ravel()
+
+    def jacobian_batch(self, t, y, f):
+        """
+        Analytic jacobian of odefun_batch. The replications don't interact, so it's block
+        diagonal with the 4x4 blocks of jacobian, and returned in the packed banded format
+        of LSODA for lband = uband = 3: jac[i, j] is stored at packed[3 + i - j, j].
+        """
+        mc = self.mc
+        r = self.r
+        rd = 0
+
+        y = y.reshape(-1, 4)
+        v = y[:, 1]
+        theta = y[:, 2]
+        a = f(t)/mc
+
+        packed = np.zeros((7, 4, y.shape[0]))
+        # d(dx)/dv, one above the diagonal
+        packed[2, 1] = np.abs(v) < self.v_max
+        # d(dtheta)/domega, one above the diagonal
+        packed[2, 3] = 1.0
+        # d(domega)/dtheta, one below the diagonal
+        packed[4, 2] = -1*g*mc*np.cos(theta)/r + a*np.sin(theta)/(mc*r)
+        # d(domega)/domega, on the diagonal
+        packed[3, 3] = -2*mc*rd/r
+        # columns are ordered like the states, replication after replication
+        return packed.transpose(0, 2, 1).reshape(7, -1)
+
+    def simulate_batch(self, y_inits, t, tu, u):
+        """
+        simulate a batch of replications at once, as one system of equations.
+
+        The rope length r of this simulation may be an array with the rope length of
+        every replication. All replications are integrated with the same time steps,
+        numpy evaluates the right-hand side for all of them in one go.
+
+        Parameters
+        ----------
+        y_inits : initial states, one row of (x, v, theta, omega) per replication
+        t : times to store the solution at
+        tu : time of the input force
+        u : input force
+
+        Returns
+        -------
+        The solution of solve_ivp, with y reshaped to (replications, 4, len(t)).
+        """
+        y_inits = np.asarray(y_inits, dtype=np.float64)
+        f = _zero_order_hold(tu, u)
+        sol = solve_ivp(lambda t, y: self.odefun_batch(t, y, f),\
+                                  [t[0], t[-1]], y_inits.ravel(), t_eval=t, method='LSODA',
+                                  jac=lambda t, y: self.jacobian_batch(t, y, f), lband=3, uband=3)
+
+        sol.y = sol.y.reshape(y_inits.shape[0], 4, -1)
+        sol.y[:, 1] = np.clip(sol.y[:, 1], -self.v_max, self.v_max)
+        return sol
+
 if __name__ == "__main__":
     import psycopg
     import matplotlib.pyplot as plt
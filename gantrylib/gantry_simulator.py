@@ -1,7 +1,10 @@
 from gantrylib.gantry_simulation import GantrySimulation
+from gantrylib.gantry_database_io import (_init_worker_connection, _pgcopy_binary, _to_pg_timestamps, _to_timestamps,
+                                          _worker_connection)
 import concurrent.futures as cf
+from itertools import repeat
+from multiprocessing import shared_memory
 import psycopg
-from datetime import timedelta, datetime
 import numpy as np
 import os
 import logging
@@ -16,88 +19,119 @@ validatortopic = None
 # need this here otherwise signal_done function can't reach it 
 # (it has but one allowed parameter)
 
-def simulate(sim, traj_id, machine_id, repl_id, t_now, dbaddr, x0, theta0, omega0):
+# input of the replications: the force samples and the first sample of the state quantities of a
+# trajectory, one row of (quantity, first ts, sample times in seconds since then, values) per quantity.
+# the rows come in a fixed order: force, then the state in the order of y_init (x, v, theta, omega)
+SIMULATION_INPUT_SQL = """SELECT quantity, min(ts), array_agg(t ORDER BY ts), array_agg(value ORDER BY ts)
+    FROM (SELECT ts, quantity, value,
+            extract(epoch FROM ts - min(ts) OVER (PARTITION BY quantity))::float8 AS t
+        FROM trajectory
+        WHERE machine_id = %(machine_id)s AND run_id = %(run_id)s
+        AND (quantity = 'force'
+            OR quantity IN ('position', 'velocity', 'angular position', 'angular velocity')
+            AND ts = (SELECT min(ts) FROM trajectory t2
+                WHERE machine_id = %(machine_id)s AND run_id = %(run_id)s
+                AND quantity IN ('position', 'velocity', 'angular position', 'angular velocity')))
+        ) samples
+    GROUP BY quantity
+    ORDER BY array_position(ARRAY['force', 'position', 'velocity', 'angular position', 'angular velocity'], quantity)"""
+
+# shared memory block with the input of the current run and the view on it, attached once per worker
+_worker_inputs = None
+
+def _init_worker(dbaddr=None):
+    """
+    initializer of the worker processes, sets up logging and opens the worker's connection
+    """
+    # the workers are separate processes, logging needs to be configured in each of them, once
+    logging.basicConfig(stream=sys.stdout, level=logging.INFO)
+    # connect while the worker is still idle instead of on its first batch
+    _init_worker_connection(dbaddr, _create_staging_table)
+
+def _create_staging_table(conn):
+    """
+    create the table results are copied into first, see simulate. temporary tables aren't
+    WAL-logged and are private to the connection, so the workers don't get in each other's way.
+    """
+    conn.execute(
+        """CREATE TEMPORARY TABLE IF NOT EXISTS simulation_staging
+           (ts timestamp NOT NULL, replication_nr int4 NOT NULL, quantity text NOT NULL, value float8)"""
+    )
+
+def _attach_inputs(name, shape):
+    """
+    read-only view of the (sample times, input force) array the parent process put in
+    the shared memory block with the given name. the block stays attached, so the other
+    replications of the run this worker handles don't attach it again.
     """
-    function that simulates one replication
+    global _worker_inputs
+    if _worker_inputs is None or _worker_inputs[0].name != name:
+        if _worker_inputs is not None:
+            _worker_inputs[0].close()
+        # workers share the parent's resource tracker, which already knows the block, so
+        # attaching here doesn't make the block this process' to clean up
+        shm = shared_memory.SharedMemory(name=name)
+        inputs = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+        inputs.flags.writeable = False
+        _worker_inputs = (shm, inputs)
+    return _worker_inputs[1]
+
+def simulate(rs, mp, traj_id, machine_id, repl_ids, t_now, dbaddr, inputs_name, inputs_shape, y_inits):
+    """
+    function that simulates a batch of replications
     Parameters
     ----------
-    sim : GantrySimulator
-        Instance of GantrySimulator that has been initialized with
-        randomly sampled values
+    rs : randomly sampled rope lengths, one per replication
+    mp : pendulum mass
     traj_id : id of the trajectory (TODO: correct name is run_id...)
     machine_id : id of the machine
-    repl_id : id of this replication
-    dbconn : connection to the database
-    t_now : zero time for writing the time vector to the database
+    repl_ids : ids of the replications
+    t_now : zero time for writing the time vector to the database (naive, the start of the trajectory)
+    dbaddr : connection string of the database
+    inputs_name : name of the shared memory block with the sample times of the input force (in
+        seconds since t_now) and the input force of the trajectory, as the rows of a float64 array
+    inputs_shape : shape of that array
+    y_inits : randomly sampled initial states (x, v, theta, omega), one row per replication
     """
-    # need to call this in every thread for logging to work, since these are separate processes that's needed.
-    logging.basicConfig(stream=sys.stdout, level=logging.INFO)
-    # start by opening connection to database
-    simid = str(traj_id) + "." + str(repl_id)
-    logging.info("Simulation " + simid + "started")
-    with psycopg.connect(dbaddr) as dbconn:
-        logging.info(simid + " got db connection " + str(dbconn))
+    simid = f"{traj_id}.{repl_ids[0]}-{repl_ids[-1]}"
+    logging.info("Simulation %s started", simid)
+    # only the parameters are sent to the worker process, the simulation object is built here.
+    # the replications only differ in rope length and initial state, so they're integrated
+    # together as one system.
+    sim = GantrySimulation(r=np.asarray(rs), mp=mp)
+    ts, u = _attach_inputs(inputs_name, inputs_shape)
+    # I guess we now have everything to setup the simulation
+    try:
+        sol = sim.simulate_batch(y_inits, ts, ts, u)
+    except Exception as e:
+        # nothing to write, run_simulations gets the exception from the pool
+        logging.error("%s Error in simulation: %s", simid, e)
+        raise
+    # simulation results can now be written to the database
+    t_db = _to_pg_timestamps(_to_timestamps(t_now, sol.t))
+    quantities = ['position', 'velocity', 'angular position', \
+                'angular velocity']
+    # the replications are laid end to end, so the whole batch is a single binary COPY.
+    # machine and run are the same for every row, they're only added when moving the rows
+    # out of the staging table.
+    n = len(sol.t)
+    columns = dict(zip(quantities, sol.y.transpose(1, 0, 2).reshape(len(quantities), -1)))
+    payload = _pgcopy_binary(np.tile(t_db, len(repl_ids)), columns, keys=(np.repeat(repl_ids, n),))
+    # the connection commits when leaving its context
+    with _worker_connection(dbaddr, _create_staging_table) as dbconn:
+        logging.debug("%s got db connection %s", simid, dbconn)
         with dbconn.cursor() as cur:
-            # fetch the trajectory input force data
-            cur.execute(f"""SELECT ts, value FROM trajectory WHERE machine_id = {machine_id} 
-                        AND run_id = {traj_id} AND quantity = 'force';""")
-            rows = cur.fetchall()
-            # bit of processing to go from datetime to just plain seconds
-            u = [row[1] for row in rows]
-            t_now = rows[0][0] # override t_now with this timestamp
-            ts = [(row[0] - rows[0][0]).total_seconds() for row in rows]
-            # fetch the trajectory velocity data (for limiting)
-            cur.execute(f"""SELECT ts, value FROM trajectory WHERE machine_id = {machine_id} 
-                        AND run_id = {traj_id} AND quantity = 'velocity';""")
-            rows = cur.fetchall()
-            # bit of processing to go from datetime to just plain seconds
-            v = [row[1] for row in rows]
-            # fetch intial values for x, v, theta and omega
-            try:
-                cur.execute(f"""select quantity, value from trajectory 
-                            where machine_id = {machine_id} 
-                            AND run_id = {traj_id} 
-                            and quantity  in ('position', 'velocity', 'angular position', 'angular velocity')
-                            and ts = (select min(ts) from trajectory t2 
-                            where machine_id = {machine_id} 
-                            AND run_id = {traj_id} 
-                            and quantity  in ('position', 'velocity', 'angular position', 'angular velocity'));""")
-            except Exception as e:
-                logging.error(simid + " Error fetching initial conditions: " + str(e))
-            rows = cur.fetchall()
-            
-            # shape will be sth like:
-            # angular position	0
-            # angular velocity	0.0
-            # position	0.0
-            # velocity	-0
-            # this needs to be ordered into y_init (x0, v0, theta0, omega0)
-            # easiest is to cast to dict I guess
-            initvals = dict(rows)
-            y_init = [initvals["position"] + x0,\
-                        initvals["velocity"],\
-                        initvals["angular position"] + theta0,\
-                        initvals["angular velocity"] + omega0]
-            # I guess we now have everything to setup the simulation
-            try:
-                sol = sim.simulate(y_init, ts, ts, u, v)
-            except Exception as e:
-                logging.error(simid + "Error in simulation: " + str(e))
-            # simulation results can now be written to the database
-            t_db = [t_now + timedelta(seconds=ts) for ts in sol.t]
-            quantities = ['position', 'velocity', 'angular position', \
-                        'angular velocity']
-            # insert the data into simulationdatapoint
-            with cur.copy("""COPY simulationdatapoint (ts, machine_id, run_id, 
-                        replication_nr, quantity, value) FROM stdin""") as copy:
-                # write all quantities
-                for idx, qty in enumerate(quantities):
-                    for (t, data) in zip(t_db, sol.y[idx]):
-                        copy.write_row((t, machine_id, traj_id, repl_id, qty, data))
-            # commit to database
-            dbconn.commit()
-        logging.info(simid + " Wrote results to database")
-    logging.info(f"{simid}: Exited dbconn context.")
+            with cur.copy("""COPY simulation_staging (ts, replication_nr, quantity, value)
+                        FROM stdin (FORMAT BINARY)""") as copy:
+                copy.write(payload)
+            # insert the data into simulationdatapoint, in the same transaction
+            cur.execute("""WITH staged AS (DELETE FROM simulation_staging
+                            RETURNING ts, replication_nr, quantity, value)
+                        INSERT INTO simulationdatapoint (ts, machine_id, run_id, replication_nr, quantity, value)
+                        SELECT ts, %s, %s, replication_nr, quantity, value FROM staged""",
+                        (machine_id, traj_id))
+        logging.info("%s Wrote results to database", simid)
+    logging.debug("%s: Exited dbconn context.", simid)
 
 class GantrySimulator():
 
@@ -118,8 +152,6 @@ class GantrySimulator():
         self.mp = config["pendulum_mass"]
         # random generator for sampling of parameters
         self.rng = np.random.default_rng()
-        # executor for parallel jobs
-        self.executor = cf.ProcessPoolExecutor(max_workers=max(os.cpu_count()-4, 4))
         
         # db setup
         self.dbaddr = "host="+config["db_address"]\
@@ -127,6 +159,15 @@ class GantrySimulator():
                     + " user=" + config["db_user"] + " password=" + config["db_password"]
         self.dbconn = psycopg.connect(self.dbaddr)
 
+        # executor for parallel jobs, every worker reuses one connection for all its replications
+        self.max_workers = max(os.cpu_count()-4, 4)
+        self.executor = cf.ProcessPoolExecutor(max_workers=self.max_workers,
+                                               initializer=_init_worker, initargs=(self.dbaddr,))
+        # the pool only starts its processes when work is submitted. start them all now, so
+        # the first run doesn't wait for the workers to start, import and connect
+        for _ in range(self.max_workers):
+            self.executor.submit(os.getpid)
+
         logging.info("Created simulator " + str(self))
 
 
@@ -156,29 +197,69 @@ class NullGantrySimulator:
         repls is the number of replications to run
         rope_length (legacy, this is not logged, it really should have been...)
         """
-        # create new simulation in database
+        # create new simulation in database, and fetch the input force and initial state. all
+        # replications simulate the same trajectory, so that's read once here instead of by every
+        # replication. the pipeline sends both (and the BEGIN) in a single round-trip.
         with self.dbconn.cursor() as cur:
-            cur.execute("""INSERT INTO simulation (run_id, 
-                        machine_id, num_replications)
-                        VALUES (%s, %s, %s)""", (run_id, self.id, repls))
+            with self.dbconn.pipeline():
+                self.dbconn.execute("""INSERT INTO simulation (run_id, 
+                            machine_id, num_replications)
+                            VALUES (%s, %s, %s)""", (run_id, self.id, repls))
+                cur.execute(SIMULATION_INPUT_SQL, {"machine_id": self.id, "run_id": run_id})
+            rows = cur.fetchall()
         self.dbconn.commit()
+        if repls == 0:
+            # the simulation is recorded, but there's nothing to run
+            logging.info("All simulations completed")
+            return
+        (_, t_now, t, values), *state = rows
+        inputs = np.array([t, values], dtype=np.float64)
+        # the state rows are ordered like y_init, their single value is the initial value
+        y0 = tuple(row[3][0] for row in state)
+        # simulationdatapoint.ts is a timestamp without time zone, keep the wall time of the
+        # trajectory's first timestamp (the text COPY dropped the offset too)
+        t_now = t_now.replace(tzinfo=None)
         logging.info(f"Setting up {repls} replications")
-        repls_ids = [i for i in range(repls)]
-        # sample values of r, x0, theta0 and omega0 for the simulation objects
-        rs = self.rng.normal(rope_length, self.rope_length_SD, repls) # 
-        x0s = self.rng.normal(0, self.position_SD, repls)
-        theta0s = self.rng.logistic(0, self.theta_SD, repls)
-        omega0s = self.rng.logistic(0, self.omega_SD, repls)
-        sims = [GantrySimulation(r=r, mp=self.mp) for r in rs]
-        t_now = datetime.min
+        # sample values of r, x0, theta0 and omega0 for the simulations, as the rows of one
+        # array that the generator fills in place
+        params = np.empty((4, repls))
+        # r and x0 are normally distributed
+        self.rng.standard_normal(out=params[0])
+        params[0] *= self.rope_length_SD
+        params[0] += rope_length
+        self.rng.standard_normal(out=params[1])
+        params[1] *= self.position_SD
+        # theta0 and omega0 follow a logistic distribution, sampled by applying its inverse
+        # CDF (the logit) to uniform samples. keep them out of 0, where the logit is infinite
+        logistic = params[2:]
+        self.rng.random(out=logistic)
+        np.maximum(logistic, np.finfo(np.float64).tiny, out=logistic)
+        # log(u) - log1p(-u) in place, with a single temporary
+        log1m = np.log1p(-logistic)
+        np.log(logistic, out=logistic)
+        logistic -= log1m
+        logistic *= [[self.theta_SD], [self.omega_SD]]
+        rs = params[0]
+        y_inits = np.tile(y0, (repls, 1))
+        y_inits[:, [0, 2, 3]] += params[1:].T
         logging.info("Submitting jobs to processing pool")
-        futs = [self.executor.submit(simulate, sim, run_id, self.id, repl_id, t_now, self.dbaddr, x0, theta0, omega0) for (sim, repl_id, x0, theta0, omega0) in zip(sims, repls_ids, x0s, theta0s, omega0s)]
-        logging.info(str([str(fut.__hash__()) for fut in futs]))
-        out = cf.wait(futs, 5)
-        while out.not_done:
-            logging.info(f"Done: {out.done}")
-            logging.info(f"Not done: {out.not_done}")
-            for fut in out.not_done:
-                logging.info(f"Future {fut.__hash__()} state: {'done' if fut.done() else 'running'}")
-            out = cf.wait(futs, 5)
+        # hand every worker one batch of replications, which it integrates at once
+        batches = np.array_split(np.arange(repls), min(repls, self.max_workers))
+        # the input arrays go to the workers through shared memory instead of being pickled into the tasks
+        shm = shared_memory.SharedMemory(create=True, size=inputs.nbytes)
+        try:
+            np.ndarray(inputs.shape, dtype=inputs.dtype, buffer=shm.buf)[:] = inputs
+            results = self.executor.map(simulate, [rs[batch] for batch in batches], repeat(self.mp),
+                                        repeat(run_id), repeat(self.id), [batch.tolist() for batch in batches],
+                                        repeat(t_now), repeat(self.dbaddr), repeat(shm.name), repeat(inputs.shape),
+                                        [y_inits[batch] for batch in batches])
+            # wait for all replications, this reraises the first exception of a batch. map hands
+            # back results in submission order, so the count is how many are done at least.
+            done = 0
+            for batch, _ in zip(batches, results):
+                done += len(batch)
+                logging.debug("%d/%d replications done", done, repls)
+        finally:
+            shm.close()
+            shm.unlink()
         logging.info("All simulations completed")
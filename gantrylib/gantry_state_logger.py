@@ -1,15 +1,227 @@
 from abc import ABC, abstractmethod
-from queue import Queue
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import shared_memory
+import tempfile
 import threading
 import time
 from datetime import datetime
 import logging
 
+import numpy as np
+
 from gantrylib.crane import Crane
-from gantrylib.gantry_database_io import DatabaseInterface
+from gantrylib.gantry_database_io import DatabaseInterface, STATE_QUANTITIES
+
+
+def _local_timestamps(ts_ns: np.ndarray) -> np.ndarray:
+    """Convert time.time_ns() values to naive local timestamps, like datetime.now() gives
+
+    Args:
+        ts_ns (np.ndarray): int64 nanoseconds since the epoch.
+
+    Returns:
+        np.ndarray: datetime64[us] array of local wall times.
+    """
+    seconds = ts_ns // 1_000_000_000
+    # look up the UTC offset once per distinct second, a batch only spans a few of them
+    unique_seconds, inverse = np.unique(seconds, return_inverse=True)
+    offsets = np.array([time.localtime(s).tm_gmtoff for s in unique_seconds.tolist()], dtype=np.int64)
+    return (ts_ns // 1000 + offsets[inverse] * 1_000_000).astype('datetime64[us]')
+
+
+class _SPSCRing:
+    """Bounded queue of samples for exactly one producer thread and one consumer thread
+
+    The samples are stored column-wise in preallocated arrays, an int64 timestamp and a
+    row of values per sample, so adding one doesn't allocate anything. Only the producer
+    moves the tail and only the consumer moves the head, so neither put nor get_batch
+    takes a lock. The event is only set when a sample arrives in an empty ring, to wake
+    up a consumer waiting in wait().
+
+    A shared ring keeps its head, tail, timestamps and values in one shared memory block,
+    so other processes can read the recent samples with a StateRingReader.
+    """
+
+    def __init__(self, capacity: int, width: int, shared: bool = False):
+        self.maxsize = capacity
+        if shared:
+            self._shm = shared_memory.SharedMemory(create=True, size=8 * (2 + capacity * (1 + width)))
+            self._counters = np.ndarray(2, dtype=np.int64, buffer=self._shm.buf)
+            self._counters[:] = 0
+            self._ts = np.ndarray(capacity, dtype=np.int64, buffer=self._shm.buf, offset=16)
+            self._values = np.ndarray((width, capacity), dtype=np.float64, buffer=self._shm.buf,
+                                      offset=16 + 8 * capacity)
+        else:
+            self._shm = None
+            self._counters = None
+            self._ts = np.empty(capacity, dtype=np.int64)
+            self._values = np.empty((width, capacity), dtype=np.float64)
+        self._head = 0
+        self._tail = 0
+        self._not_empty = threading.Event()
+
+    @property
+    def name(self) -> str:
+        """Name of the shared memory block to attach a StateRingReader to, None if not shared"""
+        return self._shm.name if self._shm is not None else None
+
+    def close(self) -> None:
+        """Release the shared memory block, readers that are still attached keep their mapping"""
+        if self._shm is not None:
+            # drop the views before closing, the buffer can't be closed while they exist
+            self._counters = self._ts = self._values = None
+            self._shm.close()
+            self._shm.unlink()
+            self._shm = None
+
+    def qsize(self) -> int:
+        return self._tail - self._head
+
+    def empty(self) -> bool:
+        return self._tail == self._head
+
+    def full(self) -> bool:
+        return self._tail - self._head >= self.maxsize
+
+    def put(self, ts: int, values) -> bool:
+        """Add a sample, returns False without adding it if the ring is full
+
+        Raises:
+            ValueError: If values isn't one value per column, e.g. None.
+        """
+        tail = self._tail
+        was_empty = tail == self._head
+        if tail - self._head >= self.maxsize:
+            return False
+        i = tail % self.maxsize
+        try:
+            # numpy would spread a single value over the column (and store None as nan), so
+            # check the length first. the slot isn't published until the tail moves.
+            if len(values) != len(self._values):
+                raise ValueError
+            self._values[:, i] = values
+        except (TypeError, ValueError):
+            raise ValueError(f"Expected {len(self._values)} values per sample, got {values!r}") from None
+        self._ts[i] = ts
+        # publish the sample before waking up the consumer
+        self._tail = tail + 1
+        if self._counters is not None:
+            self._counters[1] = tail + 1
+        if was_empty:
+            self._not_empty.set()
+        return True
+
+    def wait(self, timeout: float) -> bool:
+        """Wait until the ring isn't empty, returns False if it still is after timeout"""
+        # clear before checking, so a sample put in between sets the event again
+        self._not_empty.clear()
+        if self._tail != self._head:
+            return True
+        self._not_empty.wait(timeout)
+        return self._tail != self._head
+
+    def get_batch(self, max_items: int = None) -> tuple:
+        """Remove the oldest samples, at most max_items of them
+
+        Returns:
+            tuple: Copies of their timestamps and values, (ts, values) with values a
+                width x samples array.
+        """
+        head = self._head
+        tail = self._tail
+        if max_items is not None:
+            tail = min(tail, head + max_items)
+        index = np.arange(head, tail) % self.maxsize
+        batch = (self._ts[index], self._values[:, index])
+        self._head = tail
+        if self._counters is not None:
+            self._counters[0] = tail
+        return batch
+
+
+class _SpillFile:
+    """Measurements the database couldn't take yet, kept in a memory-mapped file
+
+    A first-in first-out ring of samples, used by the writer thread only. The samples are
+    stored row-wise, a timestamp and the values of one sample per record, so a backlog
+    of a database outage lives on disk instead of in memory.
+    """
+
+    def __init__(self, path, capacity: int, width: int):
+        self.maxsize = capacity
+        self._rows = np.memmap(path, dtype=[('ts', np.int64), ('values', np.float64, (width,))],
+                               mode='w+', shape=(capacity,))
+        self._head = 0
+        self._tail = 0
+
+    def qsize(self) -> int:
+        return self._tail - self._head
+
+    def put(self, ts: np.ndarray, values: np.ndarray) -> int:
+        """Append a batch, returns the number of its samples that didn't fit"""
+        n = min(len(ts), self.maxsize - self.qsize())
+        index = np.arange(self._tail, self._tail + n) % self.maxsize
+        self._rows['ts'][index] = ts[:n]
+        self._rows['values'][index] = values[:, :n].T
+        self._tail += n
+        return len(ts) - n
+
+    def get_batch(self, max_items: int = None) -> tuple:
+        """Remove the oldest samples, at most max_items of them, like _SPSCRing.get_batch"""
+        tail = self._tail
+        if max_items is not None:
+            tail = min(tail, self._head + max_items)
+        index = np.arange(self._head, tail) % self.maxsize
+        batch = (self._rows['ts'][index], self._rows['values'][index].T.copy())
+        self._head = tail
+        return batch
+
+
+class StateRingReader:
+    """Reads the recent samples of a shared _SPSCRing, from any process
+
+    The reader never moves the head, it doesn't take samples away from the logger. The
+    values are in the units crane.getState() returns, not yet converted to database units.
+    Attach from a process started by the logger's process, so both share the resource
+    tracker and the block isn't unlinked when the reader exits.
+    """
+
+    def __init__(self, name: str, capacity: int, width: int = len(STATE_QUANTITIES)):
+        self.maxsize = capacity
+        self._shm = shared_memory.SharedMemory(name=name)
+        self._counters = np.ndarray(2, dtype=np.int64, buffer=self._shm.buf)
+        self._ts = np.ndarray(capacity, dtype=np.int64, buffer=self._shm.buf, offset=16)
+        self._values = np.ndarray((width, capacity), dtype=np.float64, buffer=self._shm.buf,
+                                  offset=16 + 8 * capacity)
+
+    def latest(self, max_items: int = None) -> tuple:
+        """The newest samples, at most max_items of them
+
+        Returns:
+            tuple: Copies of their timestamps and values, (ts, values) with values a
+                width x samples array, oldest first.
+        """
+        tail = int(self._counters[1])
+        # the slot of the oldest sample is the one the producer may be writing to right now
+        start = max(0, tail - self.maxsize + 1)
+        if max_items is not None:
+            start = max(start, tail - max_items)
+        index = np.arange(start, tail) % self.maxsize
+        ts = self._ts[index]
+        values = self._values[:, index]
+        # samples the producer overwrote while they were copied are dropped
+        stale = max(0, int(self._counters[1]) - self.maxsize + 1 - start)
+        return ts[stale:], values[:, stale:]
+
+    def close(self) -> None:
+        self._counters = self._ts = self._values = None
+        self._shm.close()
 
 
 class StateLoggerInterface(ABC):
+    # subclasses without __slots__ still get an instance dict, this lets NullStateLogger go without
+    __slots__ = ('crane',)
 
     def __init__(self):
         self.crane = None
@@ -39,21 +251,40 @@ class StateLoggerInterface(ABC):
         pass
 
 class CraneStateLogger(StateLoggerInterface):
-    def __init__(self, crane: Crane, db_writer: DatabaseInterface, logging_rate: float = 100.0, write_rate: float = 10.0, buffer_size: int = 1000, machine_id: int = 1) -> None:
+    def __init__(self, crane: Crane, db_writer: DatabaseInterface, logging_rate: float = 100.0, write_rate: float = 10.0, buffer_size: int = 1000, machine_id: int = 1, max_batch_size: int = 5000, max_pending_writes: int = 4, shared_buffer: bool = False, batch_target: int = None, spill_file: str = None, spill_capacity: int = 360000) -> None:
         super().__init__()
         self.crane = crane
         self.db_writer = db_writer
         self.logging_interval = 1.0 / logging_rate
         self.write_interval = 1.0 / write_rate
-        self.measurement_queue = Queue(maxsize=buffer_size)
+        self.max_batch_size = max_batch_size
+        # a batch is written as soon as it has this many measurements, by default the number
+        # logged per write_interval, instead of waiting out write_interval with a backlog
+        self.batch_target = batch_target if batch_target is not None else max(1, int(logging_rate / write_rate))
+        # a shared buffer can be read by other processes, see buffer_name
+        self.measurement_queue = _SPSCRing(buffer_size, len(STATE_QUANTITIES), shared=shared_buffer)
         self.running = threading.Event()
         self.paused = threading.Event()
         self.logging_thread = None
         self.writer_thread = None
         self.machine_id = machine_id
-        self.db_lock = threading.Lock()
+        # batches are written by this thread, so the writer thread keeps draining the queue
+        # during a database round trip. at most max_pending_writes batches are in flight.
+        # it only exists while logging, see start_logging and stop_logging
+        self.max_pending_writes = max_pending_writes
+        self._db_executor = None
+        self._pending_writes = deque()  # (future, (ts, values)) of submitted batches, oldest first
+        # the batches the database can't take yet are kept in the spill file instead of in
+        # memory, and the writer thread doesn't wait for the database, see _through_spill.
+        # without a spill_file they go to an anonymous temporary file, removed when it's closed
+        self._spill = _SpillFile(spill_file or tempfile.TemporaryFile(), spill_capacity, len(STATE_QUANTITIES))
         self.start_time = datetime.now()  # Store the start time for cleanup
 
+    @property
+    def buffer_name(self) -> str:
+        """Name to attach a StateRingReader to the measurement buffer with, None unless shared_buffer"""
+        return self.measurement_queue.name
+
     def __enter__(self):
         self.start_logging()
         return self
@@ -61,10 +292,12 @@ class CraneStateLogger(StateLoggerInterface):
     def __exit__(self, exc_type, exc_val, exc_tb):
         self.stop_logging()
         self.flush_buffer()
+        self.measurement_queue.close()
 
     def start_logging(self) -> None:
         self.running.set()
         self.paused.clear()
+        self._db_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="state-db-writer")
         self.logging_thread = threading.Thread(target=self._logging_loop)
         self.writer_thread = threading.Thread(target=self._writer_loop)
         self.logging_thread.start()
@@ -81,102 +314,187 @@ class CraneStateLogger(StateLoggerInterface):
         if self.writer_thread and self.writer_thread.is_alive():
             self.writer_thread.join()
             logging.info("Writer thread joined")
+        if self._db_executor is not None:
+            # the writer thread waited for its batches, this ends the executor's thread
+            self._db_executor.shutdown(wait=True)
+            self._db_executor = None
 
     def flush_buffer(self) -> None:
         """Write remaining measurements to database"""
-        measurements = []
-        while not self.measurement_queue.empty():
-            measurements.append(self.measurement_queue.get())
-        if measurements:
-            with self.db_lock:
-                try:
-                    self.db_writer.store_state(self.machine_id, 0, measurements)
-                except Exception as e:
-                    logging.error(f"Failed to write measurements to database: {e}")
+        # only call this with the writer thread stopped (see stop_logging), the
+        # database writer isn't shared between threads, so it isn't locked
+        ts, values = self._take_batch()
+        if self._spill.qsize():
+            spilled_ts, spilled_values = self._spill.get_batch()
+            ts = np.concatenate([spilled_ts, ts])
+            values = np.concatenate([spilled_values, values], axis=1)
+        if len(ts):
+            try:
+                self._store_state(ts, values)
+            except Exception as e:
+                logging.error(f"Failed to write measurements to database: {e}")
 
     def _logging_loop(self) -> None:
         """Main logging loop that captures crane state"""
         sample_count = 0
-        start_run = time.time()
-        while self.running.is_set():
-            while self.paused.is_set():
-                # If paused, wait until resumed
-                time.sleep(0.1)
+        start_run = time.monotonic()
+        # samples are taken on a fixed grid of deadlines on the monotonic clock, so a late
+        # wake-up shortens the next sleep instead of delaying every sample after it
+        next_t = time.monotonic()
+        # look the methods used every sample up once. not the crane's, the crane can be
+        # None (the mock controller) and then getState fails per sample, which is logged
+        running = self.running.is_set
+        paused = self.paused.is_set
+        put = self.measurement_queue.put
+        time_ns = time.time_ns
+        monotonic = time.monotonic
+        while running():
+            if paused():
+                while paused():
+                    # If paused, wait until resumed
+                    time.sleep(0.1)
+                next_t = monotonic()
 
-            start_time = time.time()
-            
             try:
-                x_cart, v_cart, x_hoist, v_hoist, theta, omega, wspeed = self.crane.getState()
-                ts = datetime.now()
-
-                # database unit is m, not mm, therefore divide by 1000
-                measurement = (ts, x_cart/1000, v_cart/1000, x_hoist/1000, v_hoist/1000, theta, omega, wspeed)
-
-                if not self.measurement_queue.full():
-                    self.measurement_queue.put(measurement)
-                else:
+                # the state goes straight into the ring, it's converted a batch at a time
+                if not put(time_ns(), self.crane.getState()):
                     logging.warning("Measurement buffer full, dropping measurement")
                     
             except Exception as e:
                 logging.error(f"Error logging crane state: {e}")
 
-            # Sleep for remaining time to maintain logging rate
-            elapsed = time.time() - start_time
-            if elapsed < self.logging_interval:
-                time.sleep(self.logging_interval - elapsed)
+            # Sleep until the next deadline to maintain logging rate
+            next_t += self.logging_interval
+            slack = next_t - monotonic()
+            if slack > 0:
+                time.sleep(slack)
             else:
                 logging.warning("Logging loop took too long, skipping sleep")
-                time.sleep(0.1)  # attempt at fixing hang in the program that I don't get.
+                # start a new grid from now instead of catching up with a burst of samples
+                next_t = monotonic()
 
             sample_count += 1
             if sample_count % 50 == 0:  # Log stats every 50 samples
-                elapsed = time.time() - start_run
+                elapsed = time.monotonic() - start_run
                 actual_rate = sample_count / elapsed
                 logging.debug(f"Actual sampling rate: {actual_rate:.2f} Hz")
 
+    def _take_batch(self, max_items: int = None) -> tuple:
+        """Take the oldest measurements out of the queue, converted to database units"""
+        ts, values = self.measurement_queue.get_batch(max_items)
+        # database unit is m, not mm, therefore divide the cart and hoist position and velocity by 1000
+        values[:4] /= 1000
+        return ts, values
+
+    def _collect_batch(self) -> tuple:
+        """Collect a batch of measurements from the queue
+
+        Blocks until a first measurement arrives, then keeps collecting until
+        write_interval has passed since that measurement or batch_target is reached.
+        Everything queued by then is taken, up to max_batch_size.
+
+        Returns:
+            tuple: The timestamps and values of the collected measurements, see _take_batch,
+                empty if nothing arrived within write_interval.
+        """
+        if self.measurement_queue.wait(self.write_interval):
+            deadline = time.monotonic() + self.write_interval
+            # the queue can't hold more than maxsize, stop waiting once it's full too
+            batch_size = min(self.batch_target, self.max_batch_size, self.measurement_queue.maxsize)
+            while True:
+                missing = batch_size - self.measurement_queue.qsize()
+                remaining = deadline - time.monotonic()
+                if missing <= 0 or remaining <= 0:
+                    break
+                # measurements arrive at most every logging_interval, the batch can't be
+                # complete before that many intervals have passed, so there's no need to look sooner
+                time.sleep(min(remaining, missing * self.logging_interval))
+        return self._take_batch(self.max_batch_size)
+
     def _writer_loop(self) -> None:
         """Main database writer loop"""
-        measurements = []
-        seen_timestamps = set()  # Track timestamps we've already processed
-
-        while self.running.is_set():
-            while self.paused.is_set():
+        running = self.running.is_set
+        paused = self.paused.is_set
+        while running():
+            while paused():
                 # If paused, wait until resumed
                 time.sleep(0.1)
 
-            start_time = time.time()
-            
-            # Collect measurements from queue
-            while not self.measurement_queue.empty():
-                measurement = self.measurement_queue.get()
-                ts = measurement[0]  # Get timestamp from measurement tuple
-
-                # Only add if we haven't seen this timestamp before
-                if ts not in seen_timestamps:
-                    measurements.append(measurement)
-                    seen_timestamps.add(ts)
-                else:
-                    logging.warning(f"Duplicate timestamp detected: {ts}")
-
-            # Write to database if enough time has passed
-            if measurements:
-                with self.db_lock:
-                    try:          
-                        self.db_writer.store_state(self.machine_id, 0, measurements)
-                        logging.debug(f"Wrote {len(measurements)} measurements to database")
-                        measurements = []
-                        seen_timestamps.clear()
-                    except Exception as e:
-                        logging.error(f"Failed to write measurements to database: {e}")
-
-            # Sleep for remaining time to maintain writing rate
-            elapsed = time.time() - start_time
-            if elapsed < self.write_interval:
-                time.sleep(self.write_interval - elapsed)
-            else:
-                logging.warning("Writer loop took too long, skipping sleep")
-                time.sleep(0.1)  # attempt at fixing hang in the program that I don't get.
-                
+            # Collect a batch from the queue, this waits for measurements instead of sleeping
+            ts, values = self._collect_batch()
+
+            ts, values = self._through_spill(ts, values)
+
+            # Only keep the first measurement of every timestamp. the single producer adds
+            # them in order, so unless the wall clock stepped back there can't be any and
+            # one pass over the batch is enough to tell
+            if np.any(ts[1:] <= ts[:-1]):
+                _, first = np.unique(ts, return_index=True)
+                if len(first) < len(ts):
+                    logging.warning(f"{len(ts) - len(first)} duplicate timestamps detected")
+                    first.sort()
+                    ts, values = ts[first], values[:, first]
+
+            if len(ts):
+                self._pending_writes.append(
+                    (self._db_executor.submit(self._store_state, ts, values), (ts, values)))
+
+        # wait for the batches still in flight before the thread ends
+        # flush_buffer tries the failed ones again
+        for batch in self._finish_writes(0):
+            self._spill_batch(*batch)
+
+    def _through_spill(self, ts: np.ndarray, values: np.ndarray) -> tuple:
+        """Route a batch through the spill file while the database is behind
+
+        Failed batches and, while max_pending_writes batches are in flight, new ones are
+        spilled. Once a write can be submitted the oldest spilled measurements go first.
+
+        Returns:
+            tuple: The timestamps and values to write now, empty while the database is busy.
+        """
+        for batch in self._finish_writes(self.max_pending_writes):
+            self._spill_batch(*batch)
+        busy = len(self._pending_writes) >= self.max_pending_writes
+        if not busy and not self._spill.qsize():
+            return ts, values
+        self._spill_batch(ts, values)
+        if busy:
+            return ts[:0], values[:, :0]
+        return self._spill.get_batch(self.max_batch_size)
+
+    def _spill_batch(self, ts: np.ndarray, values: np.ndarray) -> None:
+        dropped = self._spill.put(ts, values)
+        if dropped:
+            logging.warning(f"Spill file full, dropping {dropped} measurements")
+
+    def _store_state(self, ts: np.ndarray, values: np.ndarray) -> None:
+        self.db_writer.store_state_array(self.machine_id, 0, _local_timestamps(ts),
+                                         dict(zip(STATE_QUANTITIES, values)))
+
+    def _finish_writes(self, max_pending: int) -> list:
+        """Collect the batches that were written
+
+        Waits for the oldest batches until at most max_pending are still in flight.
+
+        Args:
+            max_pending (int): Number of batches that may still be in flight afterwards.
+
+        Returns:
+            list: The (ts, values) batches that failed to be written, oldest first.
+        """
+        failed = []
+        while self._pending_writes and (len(self._pending_writes) > max_pending
+                                        or self._pending_writes[0][0].done()):
+            future, batch = self._pending_writes.popleft()
+            try:
+                future.result()
+                logging.debug(f"Wrote {len(batch[0])} measurements to database")
+            except Exception as e:
+                logging.error(f"Failed to write measurements to database: {e}")
+                failed.append(batch)
+        return failed
+
     def pause(self) -> None:
         """Pause logging temporarily"""
         self.paused.set()
@@ -195,6 +513,7 @@ class CraneStateLogger(StateLoggerInterface):
                 logging.error(f"Failed to cleanup continuous logging data: {e}")
 
 class NullStateLogger(StateLoggerInterface):
+    __slots__ = ()
 
     def start_logging(self) -> None:
         pass
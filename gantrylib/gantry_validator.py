@@ -5,20 +5,87 @@ import os
 import paho.mqtt.client as mqtt
 import concurrent.futures as cf
 import numpy as np
-from datetime import datetime, timedelta
 from gantrylib.model_validation_metrics.distance_metrics import normalized_euclidean_metric, mahalanobis_distance, rootMeanSquaredError
 from gantrylib.model_validation_metrics.frequentist_metric import calculate_frequentist_metric_interpolated, calculate_global_frequentist_metric
 from gantrylib.model_validation_metrics.reliability_metric import calculate_reliability_metric
-
-import psycopg
-
-def numToSQL(x):
-    if np.isnan(x):
-        return "'NaN'"
-    elif np.isinf(x):
-        return "'infinity'"
-    else:
-        return str(x)
+from gantrylib.gantry_database_io import (_from_pgcopy_binary, _init_worker_connection, _pgcopy_binary, _read_copy,
+                                          _to_pg_timestamptz, _worker_connection)
+from gantrylib.interpolation import _interp_rows
+
+def _quantity_metrics(qty, metrics, trajectory, sim_values, rmse, sim_mean, sim_std):
+    """Computes the metrics of one quantity, returns them by metric name."""
+    results = {}
+    try:
+        if "root mean squared error" in metrics:
+            results["root mean squared error"] = rmse[qty]
+    except Exception as e:
+        logging.info(f"rmse {e}")
+    try:
+        if "normalized euclidean distance" in metrics:
+            # expects P: 1xN array of predicition
+            #         D: 1xN array of data
+            #         D_std: 1xN standard deviation of the data
+            # In my case data and prediction are swapped.
+            # three steps need to happen:
+            # 1. calculate mean of replications
+            # 2. calculate std of replications
+            # 3. calculate the metric
+            results["normalized euclidean distance"] = normalized_euclidean_metric(trajectory[qty]["value"],
+                                                                                   sim_mean[qty], sim_std[qty])
+    except Exception as e:
+        logging.info(f"ned {e}")
+    try:
+        if "mahalanobis distance" in metrics:
+            """
+            Expects: D : M x N numpy array
+                Experimentally obtained Data, as a numpy array of length N,
+                with M replications per datapoint.
+
+            P : 1 x N numpy array
+                Model prediction as a 1 x N numpy array.
+
+            Therefore I need to group the replications together
+            """
+            # the mask of excluded samples differs per quantity, and with it the size
+            # of the covariance matrix, so this one is not stacked
+            results["mahalanobis distance"] = mahalanobis_distance(trajectory[qty]["value"], sim_values[qty])
+    except Exception as e:
+        logging.info(f"mahalanobis: {e}")
+    if "frequentist metric" in metrics or "global frequentist metric" in metrics:
+        # both take the replications as (sample times, values) pairs, stacked once
+        # into a replications x 2 x samples array
+        replications = np.stack([np.broadcast_to(trajectory[qty]["ts"], sim_values[qty].shape),
+                                 sim_values[qty]], axis=1)
+    try:
+        if "frequentist metric" in metrics:
+            """
+            X : List of 2xN numpy array
+                The replicated experimental measurements. Assumed to be a list of at least two 2xN numpy arrays, in which
+                the first row represents x and the second f(x). Each numpy array in the list may have a different length N,
+                and the values may be spaced at random, but x_0 and x_end of the final interpolation will be the intersection
+                of the various arrays in X and the single array in y, therefore if all datapoints must be used, ensure x_0 and x_end of each x array are equal.
+            
+            y : 2xN numpy array
+                Model prediction as a 2xN numpy array, where the first row represents x and the second f(x).
+                y may have a different length N, than the arrays in X, and the values may be spaced at random,
+                but x_0 and x_end of the final interpolation will be the intersection of the arrays in X and the array in y,
+                therefore if all datapoints must be used, ensure x_0 and x_end of each array are equal.
+            """
+            x_final, mu_x, E_x, conf_interval_x, f_y_interpolated = calculate_frequentist_metric_interpolated(replications, np.array([trajectory[qty]["ts"], trajectory[qty]["value"]]))
+
+            # t_db = [t_min + timedelta(seconds=ts) for ts in x_final]
+
+            results["frequentist metric"] = (mu_x + conf_interval_x, E_x + conf_interval_x)
+    except Exception as e:
+        logging.info(f"frequentist: {e}")
+    try:
+        if "global frequentist metric" in metrics:
+            results["global frequentist metric"] = calculate_global_frequentist_metric(replications, np.array([trajectory[qty]["ts"], trajectory[qty]["value"]]))
+    except Exception as e:
+        logging.info(f"global frequentist: {e}")
+    if "reliability metric" in metrics:
+        pass
+    return results
 
 def validate(run_id, machine_id, metrics, quantities, dbaddr):
     # this function is going to be a bit cumbersome, since I haven't
@@ -26,7 +93,7 @@ def validate(run_id, machine_id, metrics, quantities, dbaddr):
     logging.basicConfig(stream=sys.stdout, level=logging.INFO)
     logging.info("Validation process started")
 
-    with psycopg.connect(dbaddr) as dbconn:
+    with _worker_connection(dbaddr) as dbconn:
 
         logging.info("got dbconn " + str(dbconn))
         # step one is retrieving for this trajectory id and machine id
@@ -38,212 +105,188 @@ def validate(run_id, machine_id, metrics, quantities, dbaddr):
         # evil I'll just go with database queries for now.
         try:
             with dbconn.cursor() as cur:
-                # retrieve trajectory log for the needed quantities
-                query = "select ts, value, quantity from measurement "\
-                            + "where machine_id = " + str(machine_id)  \
-                            + " and run_id = " + str(run_id) \
-                            + " and quantity in (" + str(quantities)[1:-1] + ")" \
-                            + " order by quantity, ts;"
-                cur.execute(query)
-                ret = cur.fetchall()
-                # reuse column names
-                ts = np.array([row[0] for row in ret])
-                value = np.array([row[1] for row in ret])
-                quantity = np.array([row[2] for row in ret])
+                # retrieve trajectory log for the needed quantities. the quantity is sent as its
+                # (1-based) index in quantities, so all rows have the same size and the binary
+                # COPY output can be read as a record array instead of a row at a time.
+                # the rows are sorted on that index, so every quantity is a slice of the columns.
+                params = {"machine_id": machine_id, "run_id": run_id, "quantities": list(quantities)}
+                with cur.copy("""COPY (SELECT ts, value, array_position(%(quantities)s::text[], quantity) AS quantity_nr
+                            FROM measurement
+                            WHERE machine_id = %(machine_id)s AND run_id = %(run_id)s
+                            AND quantity = ANY(%(quantities)s::text[])
+                            ORDER BY quantity_nr, ts) TO STDOUT (FORMAT BINARY)""", params) as copy:
+                    rows = _from_pgcopy_binary(_read_copy(copy), {"ts": ">i8", "value": ">f8", "quantity": ">i4"})
+                # reuse column names. only the time since the first sample is needed, that's
+                # computed straight from the microseconds of the binary timestamps
+                ts = rows["ts"].astype(np.int64)
+                value = rows["value"].astype(np.float64)
+                # the rows of quantity i are bounds[i]:bounds[i+1]
+                bounds = np.searchsorted(rows["quantity"], np.arange(1, len(quantities) + 2))
                 trajectory = {}
-                for qty in quantities:
-                    idx = quantity == qty
+                for i, qty in enumerate(quantities):
+                    idx = slice(bounds[i], bounds[i + 1])
                     trajectory[qty] = {}
                     # convert from datetime to just seconds (might have to do this earlier, but numpy seems to be able to cope with datetime)
-                    trajectory[qty]["ts"] = np.array([td.total_seconds() for td in (ts[idx] - ts[idx][0])])
+                    trajectory[qty]["ts"] = (ts[idx] - ts[idx][0]) / 1e6
                     trajectory[qty]["value"] = value[idx]
 
                 # same for the simulated replications
-                query = "select ts, value, quantity, replication_nr  from simulationdatapoint "\
-                + "where machine_id = " + str(machine_id) \
-                + " and run_id = " + str(run_id)  \
-                + " and quantity in (" + str(quantities)[1:-1] + ")" \
-                + " order by quantity, replication_nr, ts;"
-                cur.execute(query)
-                ret = cur.fetchall()
-                ts = np.array([row[0] for row in ret])
-                value = np.array([row[1] for row in ret])
-                quantity = np.array([row[2] for row in ret])
-                replication_nr = np.array([row[3] for row in ret])
+                with cur.copy("""COPY (SELECT ts, value, array_position(%(quantities)s::text[], quantity) AS quantity_nr,
+                                replication_nr
+                            FROM simulationdatapoint
+                            WHERE machine_id = %(machine_id)s AND run_id = %(run_id)s
+                            AND quantity = ANY(%(quantities)s::text[])
+                            ORDER BY quantity_nr, replication_nr, ts) TO STDOUT (FORMAT BINARY)""", params) as copy:
+                    rows = _from_pgcopy_binary(_read_copy(copy), {"ts": ">i8", "value": ">f8", "quantity": ">i4",
+                                                                "replication_nr": ">i4"})
+                ts_us = rows["ts"].astype(np.int64)
+                value = rows["value"].astype(np.float64)
+                replication_nr = rows["replication_nr"].astype(np.int64)
                 repls = replication_nr[-1] + 1 # number of replications
-                simulation = {}
-                for qty in quantities:
-                    simulation[qty] = {}
-                    qty_idx = quantity == qty
-                    for repl in range(repls):
-                        simulation[qty][repl] = {}
-                        repl_idx = (replication_nr == repl) & qty_idx
-                        simulation[qty][repl]["ts"] = ts[repl_idx]
-                        # same conversion to seconds. Note: technically each replication has
-                        # the same ts, but maybe in the future this might not be the case
-                        simulation[qty][repl]["ts"] = np.array([td.total_seconds() for td in (ts[repl_idx] - ts[repl_idx][0])])
-                        simulation[qty][repl]["value"] = value[repl_idx]
-                        # final step: the majority of the metrics assume
-                        # equal sampling times between experiment and measurement
-                        # Assume the measured sampling times are the ones wanted,
-                        # and the simulation times are interpolated to those values.
-                        simulation[qty][repl]["value"] = np.interp(trajectory[qty]["ts"],\
-                                                                simulation[qty][repl]["ts"],\
-                                                                simulation[qty][repl]["value"])
-                        simulation[qty][repl]["ts"] = trajectory[qty]["ts"]
+                # sorted on (quantity, replication), the rows of replication r of quantity i
+                # are bounds[i*repls + r]:bounds[i*repls + r + 1]
+                group = (rows["quantity"] - 1) * repls + replication_nr
+                bounds = np.searchsorted(group, np.arange(len(quantities) * repls + 1))
+                sim_values = {}
+                for i, qty in enumerate(quantities):
+                    groups = bounds[i * repls:(i + 1) * repls + 1]
+                    # Note: technically each replication has the same ts, but maybe in the
+                    # future this might not be the case. if they do, the sample times are
+                    # converted to seconds once and the replications are the rows of one matrix.
+                    first = ts_us[groups[0]:groups[1]]
+                    shared = bool(np.all(np.diff(groups) == len(first))) \
+                        and bool(np.all(ts_us[groups[0]:groups[-1]].reshape(repls, -1) == first))
+                    if shared:
+                        sim_ts = (first - first[0]) / 1e6
+                    # final step: the majority of the metrics assume
+                    # equal sampling times between experiment and measurement
+                    # Assume the measured sampling times are the ones wanted,
+                    # and the simulation times are interpolated to those values.
+                    if shared and np.array_equal(sim_ts, trajectory[qty]["ts"]):
+                        # already sampled at the measured times, nothing to interpolate
+                        values = value[groups[0]:groups[-1]].reshape(repls, -1)
+                    elif shared and len(sim_ts) > 1 and np.all(np.diff(sim_ts) > 0):
+                        # one search of the measured times in the shared timeline for all replications
+                        values = _interp_rows(trajectory[qty]["ts"], sim_ts,
+                                              value[groups[0]:groups[-1]].reshape(repls, -1))
+                    else:
+                        values = np.empty((repls, len(trajectory[qty]["ts"])))
+                        for repl in range(repls):
+                            repl_idx = slice(groups[repl], groups[repl + 1])
+                            if not shared:
+                                # same conversion to seconds
+                                sim_ts = (ts_us[repl_idx] - ts_us[repl_idx][0]) / 1e6
+                            values[repl] = np.interp(trajectory[qty]["ts"], sim_ts, value[repl_idx])
+                    # the replications x samples matrix every metric reads
+                    sim_values[qty] = values
 
                 # other note: the metrics take all kinds of shapes of inputs
                 # e.g. lists of (ts, vals), M x N arrays, mean and std etc.
-                # storing in these dictionaries seemed the easiest way to
-                # easily loop over all quantities and built whatever input
-                # shape is needed by the metric.
+                # they're all built from the replications x samples matrix
+                # of the quantity, which is only stacked once.
 
             # can now go to the calculation of all the metrics
-            # t_min = datetime.min
+            # quantities with the same number of samples are stacked into one
+            # (quantities, replications, samples) tensor, so the rmse and the mean
+            # and std the normalized euclidean distance needs are computed for all
+            # of them at once.
+            rmse = {}
+            sim_mean = {}
+            sim_std = {}
+            same_length = {}
             for qty in quantities:
+                same_length.setdefault(len(trajectory[qty]["value"]), []).append(qty)
+            for group in same_length.values():
+                traj = np.stack([trajectory[qty]["value"] for qty in group])
+                sim = np.stack([sim_values[qty] for qty in group])
+                if "root mean squared error" in metrics:
+                    rmse.update(zip(group, rootMeanSquaredError(traj[:, None, :], sim)))
+                if "normalized euclidean distance" in metrics:
+                    sim_mean.update(zip(group, sim.mean(axis=1)))
+                    sim_std.update(zip(group, sim.std(axis=1)))
+
+            # t_min = datetime.min
+            # the scalar results of all quantities are inserted together after the loop
+            total_ned_rows = []
+            mahalanobis_rows = []
+            global_frequentist_rows = []
+            # the quantities are independent and the heavy lifting happens in numpy and
+            # scipy, which release the gil, so their metrics are computed on threads.
+            # the results are written to the database from this thread.
+            with cf.ThreadPoolExecutor(max_workers=len(quantities)) as ex:
+                results = list(ex.map(lambda qty: _quantity_metrics(qty, metrics, trajectory,
+                                                                    sim_values, rmse, sim_mean, sim_std),
+                                      quantities))
+            # the metrics are written with binary COPY, one payload per quantity built by
+            # numpy. the ts columns are timestamptz, the simulation's naive timestamps are
+            # converted like the server would cast them in this session's time zone.
+            # as before, the i-th value of a metric gets the i-th simulated timestamp.
+            ts = _to_pg_timestamptz(ts_us, dbconn.info.timezone)
+            keys = (machine_id, run_id)
+            for qty, result in zip(quantities, results):
                 try:
-                    if "root mean squared error" in metrics:
-                        replications = []
-                        for repl in simulation[qty].values():
-                            replications.append(repl["value"])
-                        
-                        d = rootMeanSquaredError(trajectory[qty]["value"], replications)
-                        d = d.tolist()
+                    if "root mean squared error" in result:
+                        d = result["root mean squared error"]
 
                         #t_db = [t_min + timedelta(seconds=ts) for ts in trajectory[qty]["ts"]]
                         #t_db = [t_min]
 
                         with dbconn.cursor() as cur:
-                            with cur.copy("""COPY rootmeansquarederror (machine_id, 
-                                        run_id, quantity, ts, distance) 
-                                        FROM stdin""") as copy:
-                                for (t, data) in zip(ts, d):
-                                    # write all quantities
-                                    copy.write_row((machine_id, run_id, qty, t, data))
+                            with cur.copy("""COPY rootmeansquarederror (ts, machine_id,
+                                        run_id, quantity, distance)
+                                        FROM stdin (FORMAT BINARY)""") as copy:
+                                copy.write(_pgcopy_binary(ts[:len(d)], {qty: d}, keys))
                 except Exception as e:
                     logging.info(f"rmse {e}")
                 try:
-                    if "normalized euclidean distance" in metrics:
-                        # expects P: 1xN array of predicition
-                        #         D: 1xN array of data
-                        #         D_std: 1xN standard deviation of the data
-                        # In my case data and prediction are swapped.
-                        # three steps need to happen:
-                        # 1. calculate mean of replications
-                        # 2. calculate std of replications
-                        # 3. calculate the metric
-                        replications = []
-                        for repl in simulation[qty].values():
-                            replications.append(repl["value"])
+                    if "normalized euclidean distance" in result:
+                        d, d_ne = result["normalized euclidean distance"]
 
-                        replications = np.array(replications)
-                        d, d_ne = normalized_euclidean_metric(trajectory[qty]["value"],
-                                                            np.mean(replications, axis=0),
-                                                            np.std(replications, axis=0))
-                        
                         # t_db = [t_min + timedelta(seconds=ts) for ts in trajectory[qty]["ts"]]
 
                         with dbconn.cursor() as cur:
                             with cur.copy("""COPY normalizedeuclideandistance (
-                                        machine_id, run_id, quantity, ts, distance)
-                                        FROM stdin""") as copy:
-                                for (t, data) in zip(ts, d):
-                                    # write all quantities
-                                    copy.write_row((machine_id, run_id, qty, t, data))
-                            query = "insert into totalnormalizedeuclideandistance (machine_id, run_id, quantity, distance) values"\
-                                        + "("+str(machine_id) +"," + str(run_id)+ ","\
-                                        + "'"+qty+"'" + "," + str(d_ne)+");"
-                            cur.execute(query)
+                                        ts, machine_id, run_id, quantity, distance)
+                                        FROM stdin (FORMAT BINARY)""") as copy:
+                                copy.write(_pgcopy_binary(ts[:len(d)], {qty: d}, keys))
+                        total_ned_rows.append((machine_id, run_id, qty, float(d_ne)))
                 except Exception as e:
                     logging.info(f"ned {e}")
+                if "mahalanobis distance" in result:
+                    mahalanobis_rows.append((machine_id, run_id, qty, float(result["mahalanobis distance"])))
                 try:
-                    if "mahalanobis distance" in metrics:
-                        """
-                        Expects: D : M x N numpy array
-                            Experimentally obtained Data, as a numpy array of length N,
-                            with M replications per datapoint.
-            
-                        P : 1 x N numpy array
-                            Model prediction as a 1 x N numpy array.
-
-                        Therefore I need to group the replications together
-                        """
-                        replications = []
-                        for repl in simulation[qty].values():
-                            replications.append(repl["value"])
-
-                        replications = np.array(replications)
-
-                        d_mahalanobis = mahalanobis_distance(trajectory[qty]["value"], replications)
-                        # get cursor to write to database
-                        with dbconn.cursor() as cur:
-                            query = "insert into mahalanobisdistance (machine_id, run_id, quantity, distance) values"\
-                            + "(" + str(machine_id) + "," + str(run_id) + ","\
-                            + "'" + qty + "'" + "," + numToSQL(d_mahalanobis) +");"
-                            cur.execute(query)
-                except Exception as e:
-                    logging.info(f"mahalanobis: {e}")
-                try:
-                    if "frequentist metric" in metrics:
-                        """
-                        X : List of 2xN numpy array
-                            The replicated experimental measurements. Assumed to be a list of at least two 2xN numpy arrays, in which
-                            the first row represents x and the second f(x). Each numpy array in the list may have a different length N,
-                            and the values may be spaced at random, but x_0 and x_end of the final interpolation will be the intersection
-                            of the various arrays in X and the single array in y, therefore if all datapoints must be used, ensure x_0 and x_end of each x array are equal.
-                        
-                        y : 2xN numpy array
-                            Model prediction as a 2xN numpy array, where the first row represents x and the second f(x).
-                            y may have a different length N, than the arrays in X, and the values may be spaced at random,
-                            but x_0 and x_end of the final interpolation will be the intersection of the arrays in X and the array in y,
-                            therefore if all datapoints must be used, ensure x_0 and x_end of each array are equal.
-                        """
-                        replications = []
-                        for repl in simulation[qty].values():
-                            replications.append([repl["ts"], repl["value"]])
-
-                        replications = np.array(replications)
-
-                        x_final, mu_x, E_x, conf_interval_x, f_y_interpolated = calculate_frequentist_metric_interpolated(replications, np.array([trajectory[qty]["ts"], trajectory[qty]["value"]]))
-                        
-                        # t_db = [t_min + timedelta(seconds=ts) for ts in x_final]
-
-                        mu_x = mu_x + conf_interval_x
-                        E_x = E_x + conf_interval_x
+                    if "frequentist metric" in result:
+                        mu_x, E_x = result["frequentist metric"]
+                        n = min(len(ts), mu_x.shape[1], E_x.shape[1])
                         with dbconn.cursor() as cur:
-                            with cur.copy("""COPY frequentistmetric (machine_id, 
-                                        run_id, quantity, ts, mu_lower, mu_upper,
-                                        error_lower, error_upper) FROM stdin""") as copy:
-                                for (t, mu_x_e, E_x_e) in zip(ts, mu_x.T, E_x.T):
-                                    copy.write_row((machine_id, run_id, qty, t, mu_x_e[0], mu_x_e[1], E_x_e[0], E_x_e[1]))
+                            with cur.copy("""COPY frequentistmetric (ts, machine_id,
+                                        run_id, quantity, mu_lower, mu_upper,
+                                        error_lower, error_upper) FROM stdin (FORMAT BINARY)""") as copy:
+                                copy.write(_pgcopy_binary(ts[:n], {qty: np.concatenate([mu_x[:, :n], E_x[:, :n]])}, keys))
                 except Exception as e:
                     logging.info(f"frequentist: {e}")
-
-                try:
-                    if "global frequentist metric" in metrics:
-                        replications = []
-                        for repl in simulation[qty].values():
-                            replications.append([repl["ts"], repl["value"]])
-
-                        replications = np.array(replications)
-
-                        avg_rel_err, avg_rel_conf_ind, max_rel_err = calculate_global_frequentist_metric(replications, np.array([trajectory[qty]["ts"], trajectory[qty]["value"]]))
-
-                        with dbconn.cursor() as cur:
-                            query = "insert into globalfrequentistmetric (machine_id, run_id, quantity, average_relative_error, average_relative_confidence_indicator, maximum_relative_error) values"\
-                                    + "(" + str(machine_id) + "," + str(run_id) + ","\
-                                    + "'" + qty + "'" + ","\
-                                    + numToSQL(avg_rel_err)+ ","\
-                                    + numToSQL(avg_rel_conf_ind) + ","\
-                                    + numToSQL(max_rel_err) + ");"
-                            cur.execute(query)
-                except Exception as e:
-                    logging.info(f"global frequentist: {e}")
-                if "reliability metric" in metrics:
-                    pass
+                if "global frequentist metric" in result:
+                    avg_rel_err, avg_rel_conf_ind, max_rel_err = result["global frequentist metric"]
+                    # NaN and infinity are sent as the float8 values they are
+                    global_frequentist_rows.append((machine_id, run_id, qty, float(avg_rel_err),
+                                                    float(avg_rel_conf_ind), float(max_rel_err)))
                     
                 # rollback for now, since there will be bugs    
                 dbconn.commit()
+
+            # executemany pipelines its statements, so all scalar results
+            # are sent in a single round trip
+            with dbconn.cursor() as cur:
+                with dbconn.pipeline():
+                    cur.executemany("""insert into totalnormalizedeuclideandistance (machine_id, run_id, quantity, distance)
+                                    values (%s, %s, %s, %s)""", total_ned_rows)
+                    cur.executemany("""insert into mahalanobisdistance (machine_id, run_id, quantity, distance)
+                                    values (%s, %s, %s, %s)""", mahalanobis_rows)
+                    cur.executemany("""insert into globalfrequentistmetric (machine_id, run_id, quantity,
+                                        average_relative_error, average_relative_confidence_indicator,
+                                        maximum_relative_error)
+                                    values (%s, %s, %s, %s, %s, %s)""", global_frequentist_rows)
+            dbconn.commit()
         except Exception as e:
             logging.info(f"Exception occured: {e}")
     logging.info("Validation process finished")
@@ -266,7 +309,8 @@ class Validator:
                     + " dbname=" + config["db_name"]\
                     + " user=" + config["db_user"] + " password=" + config["db_password"]
         # executor for parallel jobs
-        self.executor = cf.ProcessPoolExecutor(max_workers=max(os.cpu_count()-4, 4))
+        self.executor = cf.ProcessPoolExecutor(max_workers=max(os.cpu_count()-4, 4),
+                                               initializer=_init_worker_connection, initargs=(self.dbaddr,))
         # dict to store validation requests
         self.validationrequest = {}
         self.metrics_to_calc = []
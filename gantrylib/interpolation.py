@@ -0,0 +1,57 @@
+import numpy as np
+
+# traces at least this long are interpolated on several threads, for shorter
+# ones handing the rows to the threads costs more than it saves
+PARALLEL_INTERP_MIN_SAMPLES = 20000
+# from this many rows on, searching x in xp once and sharing the result between
+# the rows beats repeating the search in np.interp for every row
+SHARED_SEARCH_MIN_ROWS = 8
+
+def _interp_rows(x, xp, fp, out=None, executor=None):
+    """Linearly interpolate every row of fp at the points x
+
+    Equivalent to calling np.interp(x, xp, row) for every row, with the
+    results written into a single K x len(x) array.
+
+    Args:
+        x (np.ndarray): The points at which to interpolate.
+        xp (np.ndarray): Increasing sample points of the rows.
+        fp (np.ndarray): K x len(xp) array of values to interpolate.
+        out (np.ndarray, optional): K x len(x) float array to write the result to. Defaults to None.
+        executor (Executor, optional): Thread pool to interpolate the rows in parallel with,
+            used for traces of at least PARALLEL_INTERP_MIN_SAMPLES. Defaults to None.
+
+    Returns:
+        np.ndarray: K x len(x) array of interpolated values, out if it was given.
+    """
+    if out is None:
+        out = np.empty((len(fp), len(x)))
+    parallel = executor is not None and len(x) >= PARALLEL_INTERP_MIN_SAMPLES
+    if not parallel and len(fp) >= SHARED_SEARCH_MIN_ROWS and len(xp) > 1:
+        # interval of every x, points outside of xp use the first or last one
+        idx = np.clip(np.searchsorted(xp, x, side="right") - 1, 0, len(xp) - 2)
+        w = (x - xp[idx]) / (xp[idx + 1] - xp[idx])
+        # like np.interp, hold the first and last value outside of xp
+        np.clip(w, 0.0, 1.0, out=w)
+        left = np.take(fp, idx, axis=1)
+        np.take(fp, idx + 1, axis=1, out=out)
+        out -= left
+        out *= w
+        out += left
+        return out
+
+    # np.interp walks sorted x with a guessed binary search that starts from the
+    # previous interval, so on monotone data it is effectively a linear merge of
+    # x and xp in C. For a few rows that beats a vectorized searchsorted plus
+    # gathers, even though the search is repeated for every row.
+    def interp_row(k):
+        out[k] = np.interp(x, xp, fp[k])
+
+    if parallel:
+        # np.interp releases the GIL, so the rows really are interpolated in parallel
+        for fut in [executor.submit(interp_row, k) for k in range(len(fp))]:
+            fut.result()
+    else:
+        for k in range(len(fp)):
+            interp_row(k)
+    return out
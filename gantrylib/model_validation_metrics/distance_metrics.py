@@ -13,8 +13,11 @@ def rootMeanSquaredError(P, D):
     
     P : 1 x N numpy array
         Model prediction as a 1 x N numpy array, 
+
+    D and P may also be stacked along leading axes, e.g. Q x M x N and Q x 1 x N,
+    in which case a Q x N array is returned.
     """
-    return np.sqrt(np.mean(np.square(D-P), axis=0))
+    return np.sqrt(np.mean(np.square(D-P), axis=-2))
 
 def normalized_euclidean_metric(P, D, D_std):
     """
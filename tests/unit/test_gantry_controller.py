@@ -0,0 +1,146 @@
+import pathlib
+import tempfile
+import time
+import unittest
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import MagicMock, Mock, patch
+import numpy as np
+from scipy.signal import correlate
+from gantrylib import gantry_controller
+from gantrylib.gantry_controller import GantryController, _argmax_xcorr_bounded, _wait_until_reached
+
+class TestArgmaxXcorrBounded(unittest.TestCase):
+    def test_matches_full_correlation(self):
+        t = np.linspace(0, 5, 200)
+        a = np.sin(t) * np.exp(-t)
+        for shift in (-7, 0, 3):
+            b = np.roll(a, shift)
+            full = correlate(a, b, mode='full')
+            expected = np.argmax(full) - (len(a) - 1)
+            self.assertEqual(_argmax_xcorr_bounded(a, b, 20), expected)
+
+class FakeStepper:
+    """Stepper that moves a fixed number of counts closer to its target per read"""
+    def __init__(self, start, step):
+        self.position = start
+        self.step = step
+        self.reads = 0
+
+    def getPosition(self):
+        self.reads += 1
+        self.position = max(0, self.position - self.step)
+        return self.position
+
+class TestWaitUntilReached(unittest.TestCase):
+    def test_returns_position_within_tolerance(self):
+        stepper = FakeStepper(1000, 150)
+        position = _wait_until_reached(stepper, 0, tolerance=100)
+        self.assertLessEqual(abs(position), 100)
+        self.assertEqual(position, stepper.position)
+
+    def test_timeout(self):
+        stepper = FakeStepper(1000, 0)
+        with self.assertRaises(TimeoutError):
+            _wait_until_reached(stepper, 0, timeout=0.01)
+
+class FakeGenerator:
+    """Trajectory generator that counts how often it has to solve a problem"""
+    def __init__(self, v_cart_lim=1.0):
+        self.r = 0.5
+        self.v_cart_lim = v_cart_lim
+        self._solves = 0
+
+    def generateTrajectory(self, start, stop):
+        self._solves += 1
+        ts = np.linspace(0, 1, 5)
+        return (ts,) + tuple(np.linspace(start, stop, 5) for _ in range(7))
+
+class TestGenerateTrajectoryCache(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.cache_dir = pathlib.Path(tmp.name)
+        for name, value in (("TRAJECTORY_CACHE_DIR", self.cache_dir), ("_trajectory_memo", OrderedDict())):
+            patcher = patch.object(gantry_controller, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.controller = GantryController.__new__(GantryController)
+        self.controller.crane = None
+        self.controller.tg = FakeGenerator()
+
+    def test_reuses_solution(self):
+        first = self.controller.generateTrajectory(0.1, 0.4)
+        gantry_controller._trajectory_memo.clear()
+        second = self.controller.generateTrajectory(0.1, 0.4)
+        self.assertEqual(self.controller.tg._solves, 1)
+        np.testing.assert_array_equal(first, second)
+        self.assertEqual(len(list(self.cache_dir.glob("*.npy"))), 1)
+
+    def test_changed_config_is_solved_again(self):
+        self.controller.generateTrajectory(0.1, 0.4)
+        self.controller.tg.v_cart_lim = 2.0
+        self.controller.generateTrajectory(0.1, 0.4)
+        self.assertEqual(self.controller.tg._solves, 2)
+
+    def test_memo_and_disk_share_key(self):
+        self.controller.generateTrajectory(0.1, 0.4)
+        key = self.controller._trajectory_key(0.1, 0.4, "ocp")
+        self.assertEqual(list(gantry_controller._trajectory_memo), [key])
+        self.assertTrue((self.cache_dir / f"{key}.npy").exists())
+
+    def test_cache_size_is_capped(self):
+        with patch.object(gantry_controller, "TRAJECTORY_CACHE_SIZE", 2):
+            for stop in (0.2, 0.3, 0.4):
+                self.controller.generateTrajectory(0.1, stop)
+        self.assertEqual(len(list(self.cache_dir.glob("*.npy"))), 2)
+
+class TestMoveOptimally(unittest.TestCase):
+    def setUp(self):
+        self.controller = GantryController.__new__(GantryController)
+        self.controller.id = 1
+        self.controller.crane = MagicMock()
+        self.controller.crane.cartStepper.getPositionMm.return_value = 0.0
+        self.controller.dbconn = MagicMock()
+        self.controller._io = ThreadPoolExecutor(max_workers=2)
+        self.addCleanup(self.controller._io.shutdown)
+        self.controller._sim_fut = None
+        traj = np.zeros((8, 5))
+        traj[0] = np.arange(5) * 0.1
+        self.controller.generateTrajectory = Mock(return_value=traj)
+        patcher = patch.object(gantry_controller, 'sleep')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_failed_move_rolls_back_stored_run(self):
+        calls = []
+        def create_run(machine_id, t_start):
+            # still storing while the move fails
+            time.sleep(0.05)
+            calls.append("create_run")
+            return 7
+        self.controller.dbconn.create_run.side_effect = create_run
+        self.controller.dbconn.rollback.side_effect = lambda: calls.append("rollback")
+        self.controller.executeTrajectory = Mock(side_effect=RuntimeError("motor fault"))
+        with self.assertRaises(RuntimeError):
+            self.controller.moveOptimally(0.5, write_to_db=True)
+        self.assertEqual(calls, ["create_run", "rollback"])
+        self.controller.dbconn.commit.assert_not_called()
+
+    def test_previous_simulation_failure_is_logged(self):
+        self.controller.dbconn.create_run.return_value = 8
+        self.controller.executeTrajectory = Mock(return_value=np.zeros((6, 5)))
+        self.controller._align_measurement_to_trajectory = Mock(return_value=np.zeros((6, 5)))
+        self.controller.simulator = Mock()
+        self.controller.simrepls = 3
+        self.controller.tg = Mock(r=0.5)
+        failed = self.controller._io.submit(Mock(side_effect=RuntimeError("diverged")))
+        self.controller._sim_fut, self.controller._sim_run = failed, 7
+        with self.assertLogs(level='ERROR') as logs:
+            self.controller.moveOptimally(0.5, write_to_db=True, simulate=True)
+        self.assertIn("run 7", logs.output[0])
+        self.controller.wait_for_simulations()
+        self.controller.simulator.run_simulations.assert_called_once_with(8, 3, 0.5)
+
+if __name__ == '__main__':
+    unittest.main()
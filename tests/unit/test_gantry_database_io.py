@@ -1,5 +1,10 @@
+import struct
 import unittest
-from datetime import datetime, timedelta
+from unittest.mock import MagicMock, patch
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+import numpy as np
+from gantrylib import gantry_database_io
 from gantrylib.gantry_database_io import PostgresDatabase
 
 class TestDatabaseIO(unittest.TestCase):
@@ -30,6 +35,14 @@ class TestDatabaseIO(unittest.TestCase):
         self.pg_db.store_run(run_id, 1, test_time)
         self.pg_db.disconnect()
         
+    def test_create_run(self):
+        self.pg_db.connect()
+        expected_run_id = self.pg_db.get_next_run_id(1)
+        run_id = self.pg_db.create_run(1, datetime.now())
+        self.assertEqual(run_id, expected_run_id)
+        self.assertEqual(self.pg_db.get_next_run_id(1), run_id + 1)
+        self.pg_db.disconnect()
+
     def test_store_trajectory(self):
         self.pg_db.connect()
         run_id = self.pg_db.get_next_run_id(1)
@@ -91,5 +104,257 @@ class TestDatabaseIO(unittest.TestCase):
         self.pg_db.store_state(1, run_id, state)
         self.pg_db.disconnect()
 
+class TestConnectionPool(unittest.TestCase):
+    def setUp(self):
+        gantry_database_io._idle_connections.clear()
+
+    def tearDown(self):
+        gantry_database_io._idle_connections.clear()
+
+    @patch('gantrylib.gantry_database_io.psycopg.connect')
+    def test_connection_is_reused(self, mock_connect):
+        mock_connect.return_value = MagicMock(closed=False)
+        db1 = PostgresDatabase('localhost', 'gantrycrane', 'postgres', 'postgres')
+        db1.connect()
+        conn = db1.conn
+        db1.disconnect()
+        self.assertIsNone(db1.conn)
+        conn.rollback.assert_called_once()
+
+        db2 = PostgresDatabase('localhost', 'gantrycrane', 'postgres', 'postgres')
+        db2.connect()
+        self.assertIs(db2.conn, conn)
+        mock_connect.assert_called_once()
+
+    @patch('gantrylib.gantry_database_io.psycopg.connect')
+    def test_closed_connection_is_not_reused(self, mock_connect):
+        mock_connect.side_effect = lambda *args, **kwargs: MagicMock(closed=False)
+        db = PostgresDatabase('localhost', 'gantrycrane', 'postgres', 'postgres')
+        db.connect()
+        conn = db.conn
+        db.disconnect()
+        conn.closed = True
+        db.connect()
+        self.assertIsNot(db.conn, conn)
+        self.assertEqual(mock_connect.call_count, 2)
+
+    @patch('gantrylib.gantry_database_io.psycopg.connect')
+    def test_cursor_is_reused(self, mock_connect):
+        mock_connect.return_value = MagicMock(closed=False)
+        db = PostgresDatabase('localhost', 'gantrycrane', 'postgres', 'postgres')
+        db.connect()
+        cur = db.conn.cursor.return_value
+        ts = [datetime(2024, 1, 1)]
+        db.store_trajectory(1, 1, (ts, *[[0.0]] * 7))
+        db.store_measurement(1, 1, (ts, *[[0.0]] * 5))
+        db.conn.cursor.assert_called_once()
+        self.assertEqual(cur.copy.call_count, 2)
+        db.disconnect()
+        cur.close.assert_called_once()
+
+class TestTransaction(unittest.TestCase):
+    def setUp(self):
+        self.db = PostgresDatabase('localhost', 'gantrycrane', 'postgres', 'postgres')
+        self.db.conn = MagicMock()
+
+    def test_commit_on_success(self):
+        with self.db.transaction():
+            pass
+        self.db.conn.commit.assert_called_once()
+        self.db.conn.rollback.assert_not_called()
+
+    def test_rollback_on_error(self):
+        with self.assertRaises(ValueError):
+            with self.db.transaction():
+                raise ValueError("store failed")
+        self.db.conn.rollback.assert_called_once()
+        self.db.conn.commit.assert_not_called()
+
+class TestWorkerConnection(unittest.TestCase):
+    def setUp(self):
+        gantry_database_io._close_worker_connection()
+
+    def tearDown(self):
+        gantry_database_io._worker_conn = None
+
+    @patch('gantrylib.gantry_database_io.psycopg.connect')
+    def test_setup_runs_once_per_connection(self, mock_connect):
+        mock_connect.side_effect = lambda *args, **kwargs: MagicMock(closed=False)
+        setup = MagicMock()
+        with gantry_database_io._worker_connection('dbaddr', setup) as conn:
+            pass
+        with gantry_database_io._worker_connection('dbaddr', setup) as conn2:
+            pass
+        self.assertIs(conn, conn2)
+        setup.assert_called_once_with(conn)
+        conn.closed = True
+        with gantry_database_io._worker_connection('dbaddr', setup) as conn3:
+            pass
+        self.assertIsNot(conn3, conn)
+        self.assertEqual(setup.call_count, 2)
+
+    @patch('gantrylib.gantry_database_io.psycopg.connect')
+    def test_rollback_on_error(self, mock_connect):
+        mock_connect.return_value = MagicMock(closed=False)
+        with self.assertRaises(ValueError):
+            with gantry_database_io._worker_connection('dbaddr'):
+                raise ValueError("job failed")
+        mock_connect.return_value.rollback.assert_called_once()
+        mock_connect.return_value.commit.assert_not_called()
+
+class TestToTimestamps(unittest.TestCase):
+    def test_matches_timedelta(self):
+        t_start = datetime(2024, 5, 1, 12, 30, 15, 250000)
+        ts = np.array([0.0, 0.0000004, 0.0000005, 0.1234567, 1.5, 123.4567891])
+        expected = [t_start + timedelta(seconds=t) for t in ts.tolist()]
+        self.assertEqual(gantry_database_io._to_timestamps(t_start, ts).tolist(), expected)
+
+class TestToTimestamptz(unittest.TestCase):
+    def test_matches_local_time(self):
+        tz = ZoneInfo('Europe/Brussels')
+        # the last hour before the switch to summer time and the first one after it
+        local = [datetime(2024, 3, 31, 1, 30), datetime(2024, 3, 31, 3, 30), datetime(2024, 7, 1, 12)]
+        ts = gantry_database_io._to_pg_timestamps(local)
+        expected = [(t.replace(tzinfo=tz) - datetime(2000, 1, 1, tzinfo=timezone.utc)) // timedelta(microseconds=1)
+                    for t in local]
+        self.assertEqual(gantry_database_io._to_pg_timestamptz(ts, tz).tolist(), expected)
+        self.assertEqual(gantry_database_io._to_pg_timestamptz(ts[2:], tz).tolist(), expected[2:])
+
+    def test_transitions_match_server(self):
+        tz = ZoneInfo('Europe/Brussels')
+        # 02:30 happens twice on 2024-10-27, the server takes the second one (+01, after the
+        # transition). 02:30 doesn't exist on 2024-03-31, the server uses the offset before it (+01).
+        local = [datetime(2024, 10, 27, 2, 30), datetime(2024, 3, 31, 2, 30)]
+        expected = [datetime(2024, 10, 27, 1, 30, tzinfo=timezone.utc), datetime(2024, 3, 31, 1, 30, tzinfo=timezone.utc)]
+        expected = [(t - datetime(2000, 1, 1, tzinfo=timezone.utc)) // timedelta(microseconds=1) for t in expected]
+        for t, e in zip(local, expected):
+            ts = gantry_database_io._to_pg_timestamps([t])
+            self.assertEqual(gantry_database_io._to_pg_timestamptz(ts, tz).tolist(), [e])
+        # a batch spanning the fall-back hour looks the offsets up per second
+        local = [datetime(2024, 10, 27, 0, 30), datetime(2024, 10, 27, 2, 30), datetime(2024, 10, 27, 4, 30)]
+        ts = gantry_database_io._to_pg_timestamps(local)
+        self.assertEqual(gantry_database_io._to_pg_timestamptz(ts, tz).tolist()[1], expected[0])
+
+class TestBinaryCopy(unittest.TestCase):
+    def test_payload_layout(self):
+        base_time = datetime(2024, 1, 1, 12, 0, 0)
+        timestamps = [base_time + timedelta(seconds=0.1*i) for i in range(2)]
+        ts = gantry_database_io._to_pg_timestamps(timestamps)
+        self.assertEqual(ts[0], int((base_time - datetime(2000, 1, 1)).total_seconds()) * 1000000)
+        np.testing.assert_array_equal(gantry_database_io._to_pg_timestamps(np.array(timestamps, dtype='datetime64[us]')), ts)
+        payload = gantry_database_io._pgcopy_binary(ts, {'position': [1.0, 1.1], 'force': [5.0, 5.1]})
+
+        self.assertTrue(payload.startswith(b"PGCOPY\n\xff\r\n\x00"))
+        self.assertTrue(payload.endswith(struct.pack(">h", -1)))
+        rows = []
+        offset = 19
+        while struct.unpack_from(">h", payload, offset)[0] != -1:
+            offset += 2
+            fields = []
+            for _ in range(3):
+                length = struct.unpack_from(">i", payload, offset)[0]
+                fields.append(payload[offset + 4:offset + 4 + length])
+                offset += 4 + length
+            rows.append((struct.unpack(">q", fields[0])[0], fields[1].decode(), struct.unpack(">d", fields[2])[0]))
+        self.assertEqual(rows, [(ts[0], 'position', 1.0), (ts[1], 'position', 1.1),
+                                (ts[0], 'force', 5.0), (ts[1], 'force', 5.1)])
+
+    def test_payload_keys(self):
+        ts = np.array([0, 100000], dtype=np.int64)
+        payload = gantry_database_io._pgcopy_binary(ts, {'position': [1.0, 1.1]}, keys=(1, 7, 3))
+        # fields: count, ts, three int4 keys, quantity, value
+        row = struct.Struct(">h iq ii ii ii i8s id")
+        self.assertEqual(len(payload), 19 + 2 * row.size + 2)
+        self.assertEqual(row.unpack_from(payload, 19 + row.size),
+                         (6, 8, 100000, 4, 1, 4, 7, 4, 3, 8, b'position', 8, 1.1))
+
+    def test_payload_per_row_keys(self):
+        ts = np.array([0, 100000], dtype=np.int64)
+        payload = gantry_database_io._pgcopy_binary(ts, {'position': [1.0, 1.1]}, keys=(1, np.array([5, 6])))
+        row = struct.Struct(">h iq ii ii i8s id")
+        self.assertEqual([row.unpack_from(payload, 19 + i * row.size)[6] for i in range(2)], [5, 6])
+
+    def test_payload_multiple_values(self):
+        ts = np.array([0, 100000], dtype=np.int64)
+        payload = gantry_database_io._pgcopy_binary(ts, {'position': [[1.0, 1.1], [2.0, 2.1]]})
+        row = struct.Struct(">h iq i8s id id")
+        self.assertEqual(row.unpack_from(payload, 19 + row.size), (4, 8, 100000, 8, b'position', 8, 1.1, 8, 2.1))
+        self.assertEqual(len(payload), 19 + 2 * row.size + 2)
+
+    def test_read_payload(self):
+        rows = [(0, 1.5, 2), (1000000, -0.5, 1)]
+        payload = (gantry_database_io._PGCOPY_HEADER
+                   + b"".join(struct.pack(">hiqidii", 3, 8, t, 8, v, 4, q) for t, v, q in rows)
+                   + struct.pack(">h", -1))
+        out = gantry_database_io._from_pgcopy_binary(payload, {'ts': '>i8', 'value': '>f8', 'quantity': '>i4'})
+        self.assertEqual([(int(r['ts']), float(r['value']), int(r['quantity'])) for r in out], rows)
+
+    def test_read_copy_blocks(self):
+        payload = gantry_database_io._read_copy(iter([b"PGCOPY", memoryview(b"\n\xff")]))
+        self.assertEqual(payload, b"PGCOPY\n\xff")
+
+    def test_read_payload_with_null(self):
+        payload = (gantry_database_io._PGCOPY_HEADER + struct.pack(">hiqi", 2, 8, 0, -1)
+                   + struct.pack(">hiqid", 2, 8, 0, 8, 1.0) + struct.pack(">h", -1))
+        with self.assertRaises(ValueError):
+            gantry_database_io._from_pgcopy_binary(payload, {'ts': '>i8', 'value': '>f8'})
+
+    def test_store_trajectory_matches_array_api(self):
+        db = PostgresDatabase('localhost', 'gantrycrane', 'postgres', 'postgres')
+        db.conn = MagicMock()
+        db._cursor = MagicMock()
+        copy = db._cursor.copy.return_value.__enter__.return_value
+        ts = np.array(['2024-01-01T12:00:00', '2024-01-01T12:00:00.1'], dtype='datetime64[us]')
+        traj = np.arange(14, dtype=np.float64).reshape(7, 2)
+
+        db.store_trajectory(1, 3, (ts, *traj))
+        db.store_trajectory_array(1, 3, ts, dict(zip(gantry_database_io.TRAJECTORY_QUANTITIES, traj)))
+
+        first, second = copy.write.call_args_list
+        self.assertEqual(first, second)
+        self.assertEqual(bytes(first.args[0]), bytes(gantry_database_io._pgcopy_binary(
+            gantry_database_io._to_pg_timestamps(ts), dict(zip(gantry_database_io.TRAJECTORY_QUANTITIES, traj)))))
+
+    def test_store_state_matches_array_api(self):
+        db = PostgresDatabase('localhost', 'gantrycrane', 'postgres', 'postgres')
+        db.conn = MagicMock()
+        db._cursor = MagicMock()
+        copy = db._cursor.copy.return_value.__enter__.return_value
+        ts = np.array(['2024-01-01T12:00:00', '2024-01-01T12:00:00.01'], dtype='datetime64[us]')
+        values = np.arange(14, dtype=np.float64).reshape(7, 2)
+
+        db.store_state(1, 0, [(t.item(), *row) for t, row in zip(ts, values.T)])
+        db.store_state_array(1, 0, ts, dict(zip(gantry_database_io.STATE_QUANTITIES, values)))
+
+        first, second = copy.write.call_args_list
+        self.assertEqual(bytes(first.args[0]), bytes(second.args[0]))
+
+    def test_store_state_array_raises_after_rollback(self):
+        db = PostgresDatabase('localhost', 'gantrycrane', 'postgres', 'postgres')
+        db.conn = MagicMock()
+        db._cursor = MagicMock()
+        ts = np.array(['2024-01-01T12:00:00'], dtype='datetime64[us]')
+        columns = {qty: np.array([0.0]) for qty in gantry_database_io.STATE_QUANTITIES}
+        with patch.object(db, '_copy_samples', side_effect=Exception("connection lost")):
+            with self.assertRaises(Exception):
+                db.store_state_array(1, 0, ts, columns)
+        db.conn.rollback.assert_called_once()
+
+    def test_auto_commit_is_pipelined_with_insert(self):
+        db = PostgresDatabase('localhost', 'gantrycrane', 'postgres', 'postgres', auto_commit=True)
+        db.conn = MagicMock()
+        db._cursor = MagicMock()
+        calls = MagicMock()
+        calls.attach_mock(db.conn.pipeline, 'pipeline')
+        calls.attach_mock(db._cursor.execute, 'execute')
+        calls.attach_mock(db.conn.commit, 'commit')
+        ts = np.array(['2024-01-01T12:00:00'], dtype='datetime64[us]')
+
+        db.store_state_array(1, 0, ts, {'windspeed': [1.0]})
+
+        names = [name for name, _, _ in calls.mock_calls]
+        self.assertEqual(names, ['pipeline', 'pipeline().__enter__', 'execute', 'commit',
+                                 'pipeline().__exit__'])
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,47 @@
+import unittest
+import numpy as np
+from scipy.interpolate import interp1d
+from gantrylib.gantry_simulation import GantrySimulation, _zero_order_hold
+
+class TestZeroOrderHold(unittest.TestCase):
+    def test_matches_interp1d_zero(self):
+        rng = np.random.default_rng(0)
+        tu = np.cumsum(rng.random(40))
+        u = rng.random(40)
+        expected = interp1d(tu, u, kind='zero', bounds_error=False, fill_value="extrapolate")
+        f = _zero_order_hold(tu, u)
+        # include the sample times themselves and points outside of tu
+        for t in np.concatenate([tu, np.linspace(tu[0] - 1, tu[-1] + 1, 200)]):
+            self.assertEqual(f(t), float(expected(t)))
+
+class TestBatch(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.rs = np.array([0.25, 0.3, 0.35])
+        # include velocities beyond v_max
+        self.y = rng.standard_normal((3, 4))
+        self.y[:, 1] = [0.1, 0.5, -0.6]
+        tu = np.linspace(0, 2, 21)
+        self.f = _zero_order_hold(tu, np.sin(tu))
+
+    def test_odefun_matches_single(self):
+        batch = GantrySimulation(r=self.rs).odefun_batch(0.73, self.y.ravel(), self.f)
+        for r, y, dy in zip(self.rs, self.y, batch.reshape(-1, 4)):
+            np.testing.assert_allclose(dy, GantrySimulation(r=r).odefun(0.73, y, self.f), rtol=1e-12)
+
+    def test_jacobian_matches_single(self):
+        packed = GantrySimulation(r=self.rs).jacobian_batch(0.73, self.y.ravel(), self.f)
+        jac = np.zeros((12, 12))
+        for i in range(12):
+            for j in range(max(0, i - 3), min(12, i + 4)):
+                jac[i, j] = packed[3 + i - j, j]
+        for k, (r, y) in enumerate(zip(self.rs, self.y)):
+            block = jac[4*k:4*k + 4, 4*k:4*k + 4]
+            np.testing.assert_allclose(block, GantrySimulation(r=r).jacobian(0.73, y, self.f), rtol=1e-12)
+        # the replications don't interact
+        for k in range(3):
+            jac[4*k:4*k + 4, 4*k:4*k + 4] = 0
+        self.assertFalse(jac.any())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,33 @@
+import unittest
+from datetime import datetime
+from unittest.mock import MagicMock, patch
+import numpy as np
+from gantrylib import gantry_simulator
+
+class TestSimulate(unittest.TestCase):
+    @patch('gantrylib.gantry_simulator._worker_connection')
+    @patch('gantrylib.gantry_simulator._attach_inputs')
+    def test_failed_simulation_is_not_written(self, mock_inputs, mock_connection):
+        ts = np.linspace(0, 1, 11)
+        mock_inputs.return_value = (ts, np.zeros_like(ts))
+        with patch.object(gantry_simulator.GantrySimulation, 'simulate_batch', side_effect=RuntimeError("diverged")):
+            with self.assertLogs(level='ERROR'), self.assertRaises(RuntimeError):
+                gantry_simulator.simulate([0.3, 0.35], 0.1, 3, 1, [0, 1], datetime(2024, 1, 1), 'dbaddr',
+                                          'inputs', (2, 11), np.zeros((2, 4)))
+        mock_connection.assert_not_called()
+
+class TestRunSimulations(unittest.TestCase):
+    def test_no_replications(self):
+        simulator = gantry_simulator.GantrySimulator.__new__(gantry_simulator.GantrySimulator)
+        simulator.id = 1
+        simulator.dbconn = MagicMock()
+        simulator.executor = MagicMock()
+        # the database backed run_simulations is defined on NullGantrySimulator, after its no-op one
+        gantry_simulator.NullGantrySimulator.run_simulations(simulator, 3, 0, 0.3)
+        simulator.dbconn.execute.assert_called_once()
+        self.assertEqual(simulator.dbconn.execute.call_args.args[1], (3, 1, 0))
+        simulator.dbconn.commit.assert_called_once()
+        simulator.executor.map.assert_not_called()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,8 +1,13 @@
 import unittest
-from unittest.mock import Mock
+from unittest.mock import MagicMock, Mock, patch
+import os
+import tempfile
 import threading
 import time
-from gantrylib.gantry_state_logger import CraneStateLogger
+from datetime import datetime, timedelta
+import numpy as np
+from gantrylib.gantry_database_io import PostgresDatabase, STATE_QUANTITIES
+from gantrylib.gantry_state_logger import CraneStateLogger, StateRingReader, _SPSCRing, _local_timestamps
 
 class TestCraneStateLogger(unittest.TestCase):
     def setUp(self):
@@ -23,6 +28,15 @@ class TestCraneStateLogger(unittest.TestCase):
         self.assertEqual(self.logger.logging_interval, 0.001)
         self.assertEqual(self.logger.write_interval, 0.01)
         self.assertEqual(self.logger.measurement_queue.maxsize, 100)
+        self.assertEqual(self.logger.batch_target, 10)
+
+    def test_backlog_is_written_without_waiting(self):
+        for i in range(30):
+            self.logger.measurement_queue.put(i, self.mock_crane.getState.return_value)
+        start = time.monotonic()
+        ts, values = self.logger._collect_batch()
+        self.assertLess(time.monotonic() - start, self.logger.write_interval)
+        np.testing.assert_array_equal(ts, np.arange(30))
 
     def test_context_manager(self):
         with self.logger as l:
@@ -39,6 +53,12 @@ class TestCraneStateLogger(unittest.TestCase):
         self.logger.stop_logging()
         self.assertFalse(self.logger.running.is_set())
 
+    def test_stop_ends_database_thread(self):
+        self.logger.start_logging()
+        time.sleep(0.05)
+        self.logger.stop_logging()
+        self.assertFalse(any(thread.name.startswith("state-db-writer") for thread in threading.enumerate()))
+
     def test_pause_resume(self):
         self.logger.start_logging()
         time.sleep(0.05)  # Let it log some data
@@ -69,4 +89,185 @@ class TestCraneStateLogger(unittest.TestCase):
         self.logger.start_logging()
         time.sleep(0.05)
         self.logger.stop_logging()
-        # Should not raise exceptions, errors should be logged
\ No newline at end of file
+        # Should not raise exceptions, errors should be logged
+
+    def test_missing_state_is_not_stored(self):
+        # e.g. a crane that doesn't implement getState
+        self.mock_crane.getState.return_value = None
+        with self.assertLogs(level='ERROR') as logs:
+            self.logger.start_logging()
+            time.sleep(0.05)
+            self.logger.stop_logging()
+        self.logger.flush_buffer()
+        self.assertTrue(any("Error logging crane state" in line for line in logs.output))
+        self.mock_db_writer.store_state_array.assert_not_called()
+
+    def test_slow_failing_database_loses_nothing(self):
+        stored = []
+        def store_state_array(machine_id, run_id, ts, columns):
+            time.sleep(0.03)
+            if not stored:
+                stored.append(None)
+                raise Exception("DB error")
+            stored.extend(ts.tolist())
+        self.mock_db_writer.store_state_array.side_effect = store_state_array
+
+        self.logger.start_logging()
+        time.sleep(0.2)
+        self.logger.stop_logging()
+        self.logger.flush_buffer()
+        # every measurement is written once, including the ones of the failed batch
+        timestamps = stored[1:]
+        self.assertEqual(len(timestamps), self.mock_crane.getState.call_count)
+        self.assertEqual(len(set(timestamps)), len(timestamps))
+
+    def test_database_outage_is_spilled(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            logger = CraneStateLogger(self.mock_crane, self.mock_db_writer, logging_rate=1000.0,
+                                      write_rate=100.0, buffer_size=100, max_pending_writes=1,
+                                      spill_file=os.path.join(tmp, "spill"))
+            stored = []
+            def store_state_array(machine_id, run_id, ts, columns):
+                time.sleep(0.01)
+                if len(stored) < 5:
+                    stored.append(None)
+                    raise Exception("DB error")
+                stored.extend(ts.tolist())
+            self.mock_db_writer.store_state_array.side_effect = store_state_array
+
+            logger.start_logging()
+            time.sleep(0.2)
+            logger.stop_logging()
+            logger.flush_buffer()
+            # the writes that failed were retried from the spill file
+            timestamps = stored[5:]
+            self.assertEqual(len(timestamps), self.mock_crane.getState.call_count)
+            self.assertEqual(len(set(timestamps)), len(timestamps))
+
+    def test_outage_backlog_is_bounded_without_spill_file(self):
+        logger = CraneStateLogger(self.mock_crane, self.mock_db_writer, logging_rate=1000.0,
+                                  write_rate=100.0, buffer_size=100, max_batch_size=50)
+        sizes = []
+        def store_state_array(machine_id, run_id, ts, columns):
+            sizes.append(len(ts))
+            raise Exception("DB error")
+        self.mock_db_writer.store_state_array.side_effect = store_state_array
+
+        logger.start_logging()
+        time.sleep(0.2)
+        logger.stop_logging()
+        # the failed batches wait in the temporary spill file, they aren't resent with every write
+        self.assertLessEqual(max(sizes), 50)
+        self.assertEqual(logger._spill.qsize() + logger.measurement_queue.qsize(), self.mock_crane.getState.call_count)
+
+    def test_postgres_outage_is_spilled(self):
+        db = PostgresDatabase('localhost', 'gantrycrane', 'postgres', 'postgres')
+        db.conn = MagicMock()
+        db._cursor = MagicMock()
+        stored = []
+        failures = []
+        def copy_samples(cur, table, machine_id, run_id, ts, columns):
+            time.sleep(0.01)
+            if len(failures) < 5:
+                failures.append(None)
+                raise Exception("connection lost")
+            stored.extend(ts.tolist())
+        with tempfile.TemporaryDirectory() as tmp, patch.object(db, '_copy_samples', side_effect=copy_samples):
+            logger = CraneStateLogger(self.mock_crane, db, logging_rate=1000.0, write_rate=100.0,
+                                      buffer_size=100, max_pending_writes=1,
+                                      spill_file=os.path.join(tmp, "spill"))
+            logger.start_logging()
+            time.sleep(0.2)
+            logger.stop_logging()
+            logger.flush_buffer()
+        # the batches the database refused were kept and written afterwards
+        self.assertEqual(len(failures), 5)
+        self.assertEqual(len(stored), self.mock_crane.getState.call_count)
+        self.assertEqual(len(set(stored)), len(stored))
+
+    def test_store_state_in_database_units(self):
+        self.logger.measurement_queue.put(time.time_ns(), self.mock_crane.getState())
+        self.logger.flush_buffer()
+        _, _, ts, columns = self.mock_db_writer.store_state_array.call_args.args
+        self.assertEqual(ts.dtype, np.dtype('datetime64[us]'))
+        self.assertEqual(list(columns), list(STATE_QUANTITIES))
+        # positions and velocities in m instead of mm
+        np.testing.assert_allclose([column[0] for column in columns.values()],
+                                   [0.0001, 0.0002, 0.0003, 0.0004, 0.5, 0.6, 0.7])
+
+class TestLocalTimestamps(unittest.TestCase):
+    def test_matches_fromtimestamp(self):
+        # winter and summer time, where the local offset differs
+        for seconds in (1700000000, 1720000000):
+            ts_ns = np.array([seconds * 10**9 + 123456789], dtype=np.int64)
+            expected = datetime.fromtimestamp(seconds) + timedelta(microseconds=123456)
+            self.assertEqual(_local_timestamps(ts_ns)[0], np.datetime64(expected, 'us'))
+
+class TestSPSCRing(unittest.TestCase):
+    def test_wraps_around_in_order(self):
+        ring = _SPSCRing(4, 2)
+        for i in range(3):
+            ring.put(i, (i, -i))
+        ts, values = ring.get_batch(2)
+        np.testing.assert_array_equal(ts, [0, 1])
+        np.testing.assert_array_equal(values, [[0, 1], [0, -1]])
+        for i in range(3, 6):
+            self.assertTrue(ring.put(i, (i, -i)))
+        self.assertTrue(ring.full())
+        self.assertFalse(ring.put(6, (6, -6)))
+        ts, values = ring.get_batch()
+        np.testing.assert_array_equal(ts, [2, 3, 4, 5])
+        np.testing.assert_array_equal(values, [[2, 3, 4, 5], [-2, -3, -4, -5]])
+        self.assertTrue(ring.empty())
+
+    def test_rejects_malformed_samples(self):
+        ring = _SPSCRing(4, 2)
+        for values in (None, (1.0,), (1.0, 2.0, 3.0)):
+            with self.assertRaises(ValueError):
+                ring.put(1, values)
+        self.assertTrue(ring.empty())
+
+    def test_wait(self):
+        ring = _SPSCRing(4, 1)
+        self.assertFalse(ring.wait(0.01))
+        threading.Timer(0.01, ring.put, (1, (1.0,))).start()
+        self.assertTrue(ring.wait(1.0))
+
+    def test_threads_keep_every_item(self):
+        ring = _SPSCRing(16, 1)
+        n = 10000
+        def produce():
+            i = 0
+            while i < n:
+                if ring.put(i, (i,)):
+                    i += 1
+        producer = threading.Thread(target=produce)
+        producer.start()
+        received = []
+        while len(received) < n:
+            if ring.wait(0.1):
+                ts, values = ring.get_batch()
+                np.testing.assert_array_equal(ts, values[0])
+                received.extend(ts.tolist())
+        producer.join()
+        self.assertEqual(received, list(range(n)))
+
+    def test_shared_ring_reader(self):
+        ring = _SPSCRing(4, 2, shared=True)
+        reader = StateRingReader(ring.name, 4, 2)
+        try:
+            ts, values = reader.latest()
+            self.assertEqual(len(ts), 0)
+            for i in range(6):
+                if ring.full():
+                    ring.get_batch(1)
+                ring.put(i, (i, -i))
+            # the slot of the oldest sample is left out, the producer may be writing it
+            ts, values = reader.latest()
+            np.testing.assert_array_equal(ts, [3, 4, 5])
+            np.testing.assert_array_equal(values, [[3, 4, 5], [-3, -4, -5]])
+            ts, values = reader.latest(2)
+            np.testing.assert_array_equal(ts, [4, 5])
+        finally:
+            reader.close()
+            ring.close()
@@ -0,0 +1,50 @@
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from gantrylib.interpolation import PARALLEL_INTERP_MIN_SAMPLES, SHARED_SEARCH_MIN_ROWS, _interp_rows
+
+class TestInterpRows(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.xp = np.sort(rng.random(50)) * 5
+        self.fp = rng.random((5, 50))
+
+    def test_matches_np_interp(self):
+        # include points outside of xp, np.interp holds the end values there
+        x = np.linspace(-1, 6, 300)
+        expected = np.stack([np.interp(x, self.xp, row) for row in self.fp])
+        np.testing.assert_allclose(_interp_rows(x, self.xp, self.fp), expected)
+
+    def test_many_rows_match_np_interp(self):
+        # enough rows to search x in xp once for all of them
+        fp = np.random.default_rng(1).random((SHARED_SEARCH_MIN_ROWS + 2, 50))
+        x = np.linspace(-1, 6, 300)
+        expected = np.stack([np.interp(x, self.xp, row) for row in fp])
+        np.testing.assert_allclose(_interp_rows(x, self.xp, fp), expected)
+        out = np.empty((len(fp) + 1, 300))
+        result = _interp_rows(x, self.xp, fp, out=out[1:])
+        self.assertTrue(np.shares_memory(result, out))
+        np.testing.assert_allclose(out[1:], expected)
+
+    def test_out(self):
+        x = np.linspace(0, 5, 100)
+        out = np.empty((6, 100))
+        result = _interp_rows(x, self.xp, self.fp, out=out[1:])
+        self.assertTrue(np.shares_memory(result, out))
+        expected = np.stack([np.interp(x, self.xp, row) for row in self.fp])
+        np.testing.assert_allclose(out[1:], expected)
+
+    def test_executor(self):
+        x = np.linspace(-1, 6, PARALLEL_INTERP_MIN_SAMPLES)
+        expected = np.stack([np.interp(x, self.xp, row) for row in self.fp])
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            np.testing.assert_array_equal(_interp_rows(x, self.xp, self.fp, executor=executor), expected)
+
+    def test_single_sample(self):
+        x = np.linspace(0, 1, 10)
+        result = _interp_rows(x, self.xp[:1], self.fp[:, :1])
+        self.assertEqual(result.shape, (5, 10))
+        np.testing.assert_array_equal(result[:, 3], self.fp[:, 0])
+
+if __name__ == '__main__':
+    unittest.main()